@@ -0,0 +1,158 @@
+# Benchmarks of the dashboard backend on synthetic Brightway projects of growing size, e.g.
+# `python dev/benchmarks.py --scales small medium --output bench.json --plot scaling.html`.
+# With `--baseline bench.json`, the run fails if a benchmark is slower than `--threshold` times its baseline.
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import bw2calc as bc
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gsa_dash"))
+
+from synthetic_project import create_synthetic_project  # noqa: E402
+from backend.data import collect_XY, read_pickle, write_json  # noqa: E402
+from backend.life_cycle_assessment import get_bw_activity_and_method  # noqa: E402
+from backend.monte_carlo import (  # noqa: E402
+    run_simulations_from_X_chunk, run_simulations_from_X_all, create_dp_X, get_dps_without_background_uncertainty
+)
+from backend.sensitivity_analysis import (  # noqa: E402
+    compute_model_linearity, compute_spearman_coefficients, collect_sensitivity_results
+)
+from backend.validation import run_validation_step  # noqa: E402
+
+SCALES = {
+    "small": dict(n_activities=50, iterations=100),
+    "medium": dict(n_activities=200, iterations=500),
+    "large": dict(n_activities=1000, iterations=2000),
+}
+REPEAT = 3
+SEED = 42
+THRESHOLD = 1.5
+VALIDATION_INFLUENTIAL = 10
+
+
+def measure(func, repeat=REPEAT):
+    """Minimum wall time of `repeat` calls, as in asv, minimum is the least noisy estimate."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def write_random_run(directory, iterations, n_inputs, n_chunks=10):
+    """Run directory with random X and Y chunks, so that file benchmarks do not depend on LCA solves."""
+    rng = np.random.default_rng(SEED)
+    iterations_chunk = iterations // n_chunks
+    for i in range(n_chunks):
+        write_json(rng.random((iterations_chunk, n_inputs)).tolist(), directory / f"X{i:03d}.json")
+        write_json(rng.random(iterations_chunk).tolist(), directory / f"Y{i:03d}.json")
+
+
+def run_benchmarks(scale, n_activities, iterations):
+    config = create_synthetic_project(f"GSA dash benchmark {scale}", n_activities=n_activities, seed=SEED)
+    project, database, activity, method = config["project"], config["database"], config["activity"], config["method"]
+    lca_mc_config = dict(**config, amount=1, iterations=iterations, iterations_chunk=iterations, seed=SEED)
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp) / "run"
+        directory.mkdir()
+        run_simulations_from_X_all(directory, lca_mc_config)
+        X, Y = collect_XY(directory)
+        indices = read_pickle(directory / "indices.pickle")
+        print(f"{scale}: {n_activities} activities, {X.shape[1]} uncertain inputs, {iterations} iterations")
+
+        results["run_simulations_from_X_chunk"] = measure(lambda: run_simulations_from_X_chunk(
+            project, database, activity, 1, method, iterations, SEED
+        ))
+
+        bw_activity, bw_method = get_bw_activity_and_method(project, database, activity, method)
+
+        def sample_inputs():
+            lca = bc.LCA(
+                {bw_activity.id: 1}, data_objs=get_dps_without_background_uncertainty(bw_method),
+                use_distributions=True, seed_override=SEED,
+            )
+            lca.lci()
+            create_dp_X(lca, iterations, "technosphere", "benchmark", SEED)
+
+        results["create_dp_X"] = measure(sample_inputs)
+
+        random_directory = Path(tmp) / "random"
+        random_directory.mkdir()
+        write_random_run(random_directory, iterations, X.shape[1])
+        results["collect_XY"] = measure(lambda: collect_XY(random_directory))
+        results["compute_model_linearity"] = measure(lambda: compute_model_linearity(X, Y))
+        results["compute_spearman_coefficients"] = measure(lambda: compute_spearman_coefficients(X, Y))
+        S = compute_spearman_coefficients(X, Y)
+        results["collect_sensitivity_results"] = measure(lambda: collect_sensitivity_results(project, S, {}, indices))
+
+        val_directory = directory / "validation"
+        val_directory.mkdir()
+        mask_inf = np.argsort(S)[-1::-1][:VALIDATION_INFLUENTIAL]
+        results["run_validation_step"] = measure(lambda: run_validation_step(
+            val_directory, mask_inf, iterations, bw_activity, 1, bw_method
+        ))
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for scale, timings in results.items():
+        for name, seconds in timings.items():
+            seconds_baseline = baseline.get(scale, {}).get(name)
+            if (seconds_baseline is not None) and seconds > threshold * seconds_baseline:
+                regressions.append(f"{name} ({scale}): {seconds:.3f} s, baseline {seconds_baseline:.3f} s")
+    return regressions
+
+
+def plot_scaling(results, fp):
+    import plotly.graph_objects as go
+    scales = list(results.keys())
+    fig = go.Figure()
+    for name in results[scales[0]]:
+        fig.add_trace(go.Scatter(
+            x=[SCALES[scale]["n_activities"] for scale in scales], y=[results[scale][name] for scale in scales],
+            mode="markers+lines", name=name,
+        ))
+    fig.update_xaxes(title="Number of activities", type="log")
+    fig.update_yaxes(title="Time, seconds", type="log")
+    fig.write_html(fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the GSA dashboard backend.")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(SCALES))
+    parser.add_argument("--output", help="Write results to this JSON file, e.g. to use them as a baseline.")
+    parser.add_argument("--baseline", help="JSON file with results of a previous run.")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Slowdown relative to the baseline that counts as a regression.")
+    parser.add_argument("--plot", help="Write scaling curves to this HTML file.")
+    args = parser.parse_args(argv)
+    results = dict()
+    for scale in args.scales:
+        results[scale] = run_benchmarks(scale, **SCALES[scale])
+        for name, seconds in results[scale].items():
+            print(f"  {name:<32} {seconds:10.4f} s")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.plot is not None:
+        plot_scaling(results, args.plot)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# Compare convergence of random, quasi-Monte Carlo and Latin hypercube sampling on a synthetic project, e.g.
+# `python dev/sampling_convergence.py --replicates 10 --plot convergence.html`.
+# Errors of the mean, standard deviation and GSA ranking are measured against a large random reference run, and the
+# report lists how many fewer iterations each design needs to match the error of random sampling. Runs are split into
+# chunks like in the dashboard, so that the designs are measured as the dashboard samples them.
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from scipy.stats import spearmanr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gsa_dash"))
+
+from synthetic_project import create_synthetic_project  # noqa: E402
+from backend.data import collect_XY  # noqa: E402
+from backend.monte_carlo import run_simulations_from_X_all  # noqa: E402
+from backend.sampling import SAMPLING_DESIGNS  # noqa: E402
+from backend.sensitivity_analysis import compute_spearman_coefficients  # noqa: E402
+
+ITERATIONS = [64, 128, 256, 512, 1024]
+ITERATIONS_REFERENCE = 8192
+REPLICATES = 10
+CHUNKS = 10  # the dashboard proposes chunks of a tenth of the iterations
+SEED = 42
+METRICS = ["mean", "std", "ranking"]
+
+
+def run(config, iterations, seed, sampling, chunks=CHUNKS):
+    lca_mc_config = dict(
+        **config, amount=1, iterations=iterations, iterations_chunk=int(np.ceil(iterations / chunks)), seed=seed,
+        sampling=sampling,
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        run_simulations_from_X_all(directory, lca_mc_config)
+        X, Y = collect_XY(directory)
+    return Y, compute_spearman_coefficients(X, Y)
+
+
+def get_errors(Y, S, reference):
+    Y_ref, S_ref = reference
+    return dict(
+        mean=abs(np.mean(Y) - np.mean(Y_ref)) / abs(np.mean(Y_ref)),
+        std=abs(np.std(Y) - np.std(Y_ref)) / np.std(Y_ref),
+        # Disagreement of the GSA ranking with the reference ranking
+        ranking=1 - spearmanr(S, S_ref).correlation,
+    )
+
+
+def compare_designs(config, iterations_list, replicates, chunks=CHUNKS):
+    """Root mean squared error of each metric, design and number of iterations over `replicates` runs."""
+    reference = run(config, ITERATIONS_REFERENCE, SEED, "random", chunks)
+    errors = {design: {metric: [] for metric in METRICS} for design in SAMPLING_DESIGNS}
+    for design in SAMPLING_DESIGNS:
+        for iterations in iterations_list:
+            replicate_errors = [
+                get_errors(*run(config, iterations, SEED + 1 + r, design, chunks), reference) for r in range(replicates)
+            ]
+            for metric in METRICS:
+                rmse = np.sqrt(np.mean([e[metric] ** 2 for e in replicate_errors]))
+                errors[design][metric].append(float(rmse))
+            print(f"{design:<8} {iterations:6d} iterations: " + ", ".join(
+                f"{metric} {errors[design][metric][-1]:.4f}" for metric in METRICS
+            ))
+    return errors
+
+
+def get_iteration_savings(errors, iterations_list):
+    """How many times fewer iterations each design needs to reach the error of random sampling at most iterations."""
+    savings = {}
+    for design in SAMPLING_DESIGNS:
+        savings[design] = {}
+        for metric in METRICS:
+            target = errors["random"][metric][-1]
+            # Errors decrease as a power of the number of iterations, interpolate on the log-log scale
+            log_errors, log_iterations = np.log(errors[design][metric]), np.log(iterations_list)
+            slope, intercept = np.polyfit(log_iterations, log_errors, 1)
+            iterations_needed = np.exp((np.log(target) - intercept) / slope) if slope < 0 else np.inf
+            savings[design][metric] = iterations_list[-1] / iterations_needed
+    return savings
+
+
+def plot_convergence(errors, iterations_list, fp):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    fig = make_subplots(rows=1, cols=len(METRICS), subplot_titles=METRICS)
+    for design, label in SAMPLING_DESIGNS.items():
+        for j, metric in enumerate(METRICS):
+            fig.add_trace(go.Scatter(
+                x=iterations_list, y=errors[design][metric], mode="markers+lines", name=label, legendgroup=design,
+                showlegend=(j == 0),
+            ), row=1, col=j+1)
+    fig.update_xaxes(title="Iterations", type="log")
+    fig.update_yaxes(title="RMSE", type="log")
+    fig.write_html(fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convergence of sampling designs for MC simulations.")
+    parser.add_argument("--activities", type=int, default=100)
+    parser.add_argument("--replicates", type=int, default=REPLICATES)
+    parser.add_argument("--chunks", type=int, default=CHUNKS, help="Chunks per run, 1 samples every run at once.")
+    parser.add_argument("--plot", help="Write convergence curves to this HTML file.")
+    args = parser.parse_args(argv)
+    config = create_synthetic_project(f"GSA dash convergence {args.activities}", n_activities=args.activities, seed=SEED)
+    errors = compare_designs(config, ITERATIONS, args.replicates, args.chunks)
+    savings = get_iteration_savings(errors, ITERATIONS)
+    print("\nIterations saved compared to random sampling:")
+    for design in SAMPLING_DESIGNS:
+        print(f"  {design:<8} " + ", ".join(f"{metric} {savings[design][metric]:.1f}x" for metric in METRICS))
+    if args.plot is not None:
+        plot_convergence(errors, ITERATIONS, args.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Report how long the dashboard takes to start and to serve its first page, with the slowest imports, e.g.
+# `python dev/startup_time.py --top 20`. Exits with an error if the time to first page exceeds `--target` seconds.
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+APP_DIRECTORY = Path(__file__).resolve().parent.parent / "gsa_dash"
+TARGET = 1.0  # seconds from interpreter start to the first served page
+
+STARTUP_CODE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.server.test_client()
+for url in ["/", "/_dash-layout", "/_dash-dependencies"]:
+    assert client.get(url).status_code == 200, url
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_page": served - imported}))
+"""
+
+
+def parse_importtime(stderr):
+    """Own import time of every package and cumulative time of every import of app.py, in seconds.
+
+    `python -X importtime` lists nested imports, indented by two spaces per level, before the module that imports them.
+    """
+    packages, children, app_imports = defaultdict(float), dict(), dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        module = name.strip()
+        packages[module.split(".")[0]] += int(self_us) / 1e6
+        if depth == 1:
+            children[module] = int(cumulative_us) / 1e6
+        elif depth == 0:
+            if module == "app":
+                app_imports = children
+            children = dict()
+    return packages, app_imports
+
+
+def measure_startup():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+        cwd=APP_DIRECTORY, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    packages, app_imports = parse_importtime(result.stderr)
+    return timings, packages, app_imports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup time of the GSA dashboard.")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest packages to list.")
+    parser.add_argument("--target", type=float, default=TARGET, help="Target time to first page in seconds.")
+    args = parser.parse_args(argv)
+    timings, packages, app_imports = measure_startup()
+    total = timings["import"] + timings["first_page"]
+    print(f"Import of app.py: {timings['import']:.3f} s")
+    print(f"First page and layout: {timings['first_page']:.3f} s")
+    print(f"Time to first page: {total:.3f} s (target {args.target:.3f} s)\n")
+    print("Slowest packages, own import time:")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {package:<32} {seconds:8.3f} s")
+    print("\nImports of app.py, cumulative time:")
+    for module, seconds in sorted(app_imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {module:<32} {seconds:8.3f} s")
+    return 0 if total <= args.target else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# Build a synthetic Brightway project to run the dashboard and benchmarks without a licensed ecoinvent, e.g.
+# `python dev/synthetic_project.py --activities 500 --uncertain-fraction 0.5`.
+import argparse
+
+import bw2data as bd
+import numpy as np
+from stats_arrays import LognormalUncertainty, NormalUncertainty, UniformUncertainty, TriangularUncertainty
+
+BIOSPHERE = "biosphere3"  # name is expected by the dashboard backend
+BACKGROUND = "ecoinvent synthetic"  # background databases are found by "ecoinvent" in their name
+FOREGROUND = "synthetic foreground"
+METHOD = ("IPCC 2013", "climate change", "GWP 100a")
+DISTRIBUTIONS = ("lognormal", "normal", "uniform", "triangular")
+
+
+def get_uncertainty(amount, distribution, rng):
+    if distribution == "lognormal":
+        return dict(uncertainty_type=LognormalUncertainty.id, loc=np.log(amount), scale=rng.uniform(0.1, 0.5))
+    elif distribution == "normal":
+        return dict(uncertainty_type=NormalUncertainty.id, loc=amount, scale=0.1 * amount)
+    elif distribution == "uniform":
+        return dict(uncertainty_type=UniformUncertainty.id, minimum=0.5 * amount, maximum=1.5 * amount)
+    elif distribution == "triangular":
+        return dict(uncertainty_type=TriangularUncertainty.id, loc=amount, minimum=0.5 * amount, maximum=1.5 * amount)
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+def create_exchange(input_key, amount, exchange_type, uncertain, distributions, rng):
+    exchange = {"input": input_key, "amount": amount, "type": exchange_type}
+    if uncertain:
+        exchange.update(get_uncertainty(amount, rng.choice(distributions), rng))
+    return exchange
+
+
+def create_activity(name, exchanges, output_key):
+    production = {"input": output_key, "amount": 1, "type": "production"}
+    return {
+        "name": name, "reference product": name, "location": "GLO", "unit": "kilogram", "type": "process",
+        "exchanges": [production] + exchanges,
+    }
+
+
+def create_synthetic_project(
+        project, n_activities=100, n_biosphere=20, foreground_fraction=0.2, inputs_per_activity=3,
+        flows_per_activity=2, uncertain_fraction=0.5, distributions=DISTRIBUTIONS, seed=42, overwrite=False,
+):
+    """Create a project with biosphere, background and foreground databases, and one impact assessment method.
+
+    Every activity has `inputs_per_activity` technosphere and `flows_per_activity` biosphere exchanges, which sets the
+    sparsity of the matrices. Technosphere inputs of an activity sum to less than one unit of its product, so that the
+    technosphere matrix is always invertible. A share `uncertain_fraction` of exchanges gets a random distribution out
+    of `distributions`. Returns the project, foreground database, id of the functional unit activity and method, in
+    the format of dashboard inputs.
+    """
+    if project in bd.projects and overwrite:
+        bd.projects.delete_project(project, delete_dir=True)
+    bd.projects.set_current(project)
+    rng = np.random.default_rng(seed)
+    n_foreground = max(int(n_activities * foreground_fraction), 1)
+    n_background = max(n_activities - n_foreground, 1)
+
+    if BIOSPHERE not in bd.databases:
+        flows = {
+            (BIOSPHERE, f"flow-{i}"): {
+                "name": f"Emission {i}", "unit": "kilogram", "type": "emission", "categories": ("air",),
+            }
+            for i in range(n_biosphere)
+        }
+        bd.Database(BIOSPHERE).write(flows)
+        cfs = [((BIOSPHERE, f"flow-{i}"), float(rng.lognormal(0, 1))) for i in range(n_biosphere)]
+        method = bd.Method(METHOD)
+        method.register(unit="kg CO2-Eq")
+        method.write(cfs)
+
+    def create_database(name, n, suppliers):
+        keys = [(name, f"activity-{i}") for i in range(n)]
+        data = {}
+        for i, key in enumerate(keys):
+            candidates = [s for s in suppliers + keys if s != key]
+            inputs = rng.choice(len(candidates), size=min(inputs_per_activity, len(candidates)), replace=False)
+            exchanges = [
+                create_exchange(
+                    candidates[j], float(rng.uniform(0.01, 0.9 / inputs_per_activity)), "technosphere",
+                    rng.random() < uncertain_fraction, distributions, rng,
+                )
+                for j in inputs
+            ]
+            flows = rng.choice(n_biosphere, size=min(flows_per_activity, n_biosphere), replace=False)
+            exchanges += [
+                create_exchange(
+                    (BIOSPHERE, f"flow-{j}"), float(rng.lognormal(0, 1)), "biosphere",
+                    rng.random() < uncertain_fraction, distributions, rng,
+                )
+                for j in flows
+            ]
+            data[key] = create_activity(f"{name} {i}", exchanges, key)
+        bd.Database(name).write(data)
+        return keys
+
+    if BACKGROUND not in bd.databases:
+        create_database(BACKGROUND, n_background, [])
+    if FOREGROUND not in bd.databases:
+        background_keys = [(BACKGROUND, f"activity-{i}") for i in range(n_background)]
+        create_database(FOREGROUND, n_foreground, background_keys)
+
+    activity = bd.get_activity((FOREGROUND, "activity-0"))
+    return dict(project=project, database=FOREGROUND, activity=activity.id, method=", ".join(METHOD))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create a synthetic Brightway project for the GSA dashboard.")
+    parser.add_argument("--project", default="GSA dash synthetic")
+    parser.add_argument("--activities", type=int, default=100)
+    parser.add_argument("--biosphere", type=int, default=20)
+    parser.add_argument("--inputs-per-activity", type=int, default=3)
+    parser.add_argument("--uncertain-fraction", type=float, default=0.5)
+    parser.add_argument("--distributions", nargs="+", default=list(DISTRIBUTIONS), choices=DISTRIBUTIONS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args(argv)
+    config = create_synthetic_project(
+        args.project, n_activities=args.activities, n_biosphere=args.biosphere,
+        inputs_per_activity=args.inputs_per_activity, uncertain_fraction=args.uncertain_fraction,
+        distributions=tuple(args.distributions), seed=args.seed, overwrite=args.overwrite,
+    )
+    print(config)
+
+
+if __name__ == '__main__':
+    main()
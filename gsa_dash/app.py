@@ -1,6 +1,6 @@
 # Run this app with `python app.py` and
 # visit http://127.0.0.1:8050/ in your web browser.
-import bw2data as bd
+import uuid
 from pathlib import Path
 
 # Dash
@@ -8,7 +8,8 @@ import dash
 from dash import Dash, Input, Output, State, ctx
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
-import time
+from flask import Response, request, abort
+from urllib.parse import quote
 
 # Local files
 from layout import (
@@ -18,19 +19,39 @@ from layout import (
     get_mc_config,
     get_lca_mc_config,
     get_val_config,
+    get_style_data_conditional,
     style_bars_in_datatable,
+    color_even,
 )
 
-from backend.data import create_directory, collect_Y, get_Y_files, collect_XY, read_pickle, get_val_state
-from backend.life_cycle_assessment import compute_deterministic_score
+from backend.convergence import read_convergence_report
+from backend.data import (
+    create_run_directory, create_validation_directory, collect_XY, collect_run_Y, get_val_state,
+    clear_cancel, is_cache_directory, read_ranking,
+)
+from backend.events import stream_events, clear_events, read_events
+from backend.jobs import run_single_flight, cancel_job, is_detached, clear_detached
+from backend.metrics import (
+    collect_metrics, format_prometheus, read_run_timings, get_throughput, MC_STAGES, VALIDATION_STAGES
+)
+from backend.work_queue import SQLiteBroker, run_simulations_distributed, run_validation_distributed
+from backend.activity_index import get_activity_index
+from backend.life_cycle_assessment import compute_deterministic_score, compute_all_scores
 from backend.monte_carlo import run_simulations_from_X_all
-from backend.sensitivity_analysis import (
-    compute_model_linearity, compute_sensitivity_indices, collect_sensitivity_results, contribution_analysis
+from backend.projects import project_context
+from backend.results import read_results, list_results
+from backend.streaming import get_Y_reader
+from backend.validation import run_validation, collect_validation_results, predict_validation_surrogate
+from backend.writer import WRITER_QUEUE_SIZE
+from backend.x_store import has_X_store, read_X_columns
+from make_figures import (
+    plot_mc_simulations, plot_model_linearity, query_table_gsa_ranking, plot_validation, plot_stage_timings
+)
+from pipeline import run_sensitivity_analysis
+from constants import (
+    ITERATIONS, SEED, EVENTS_POLL_TIME, EVENTS_TIMEOUT, LINEARITY_THRESHOLD, SURROGATE_MODEL, ACTIVITY_SEARCH_LIMIT,
+    WORK_QUEUE, VALIDATION_TARGET,
 )
-from backend.validation import run_validation, collect_validation_results
-from make_figures import plot_mc_simulations, plot_model_linearity, create_table_gsa_ranking, plot_validation
-from constants import ITERATIONS, INTERVAL_TIME, LINEARITY_THRESHOLD, GT_CUTOFF, GT_MAXCALC, PAGE_SIZE
-
 
 app = Dash(
     __name__,
@@ -39,6 +60,80 @@ app = Dash(
     external_stylesheets=[dbc.themes.PULSE]
 )
 app.layout = create_layout()
+# WSGI application for production servers, e.g. `python gsa_dash/cli.py serve`
+server = app.server
+
+
+@app.server.route("/events")
+def events_stream():
+    """Server-sent progress events of MC or validation run in `directory`."""
+    directory = request.args.get("directory")
+    if (directory is None) or (not is_cache_directory(directory)):
+        abort(404)
+    offset = int(request.headers.get("Last-Event-ID", 0))
+    return Response(
+        stream_events(directory, offset, EVENTS_POLL_TIME, EVENTS_TIMEOUT),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def get_events_url(directory):
+    return f"/events?directory={quote(str(directory))}"
+
+
+def check_directories(*directories):
+    """Directories come from the browser, callbacks stop unless every given directory is in the cache."""
+    if any((directory is not None) and not is_cache_directory(directory) for directory in directories):
+        raise PreventUpdate
+
+
+def get_sensitivity_indices(gsa_directory):
+    """Sensitivity indices of the GSA results on the server, the browser only holds the run directory."""
+    if gsa_directory is None:
+        raise PreventUpdate
+    check_directories(gsa_directory)
+    results = read_results(gsa_directory)
+    if results is None:
+        raise PreventUpdate
+    return results["sensitivity_indices"]
+
+
+def format_progress(progress, eta=None):
+    """Progress bar label, with the estimated time left once the throughput is measured."""
+    if (eta is None) or (progress >= 100):
+        return f"{progress:2.0f}%"
+    minutes, seconds = divmod(int(round(eta)), 60)
+    return f"{progress:2.0f}%, {minutes} min {seconds:02d} s left" if minutes else f"{progress:2.0f}%, {seconds} s left"
+
+
+@app.server.route("/metrics")
+def metrics():
+    """Stage durations and processed items of all processes, in Prometheus text format or as JSON."""
+    stages = collect_metrics()
+    if request.args.get("format") == "json":
+        return stages
+    return Response(format_prometheus(stages), mimetype="text/plain; version=0.0.4")
+
+
+@app.callback(
+    Output("session", "data"),
+    Input("session", "id"),
+    State("session", "data"),
+)
+def create_session(_, session):
+    if session is not None:
+        raise PreventUpdate
+    return uuid.uuid4().hex
+
+
+@app.callback(
+    Output('project', 'options'),
+    Input('project', 'id'),
+)
+def get_projects(_):
+    import bw2data as bd
+    return [p.name for p in bd.projects]
 
 
 @app.callback(
@@ -47,26 +142,65 @@ app.layout = create_layout()
     Input('project', 'value'),
 )
 def get_methods_databases(project):
+    import bw2data as bd
     if project is None:
         raise PreventUpdate
-    bd.projects.set_current(project)
-    # methods = [", ".join(m) for m in bd.methods if "superseded" not in str(m)]  # TODO uncomment in the end
-    methods = [", ".join(('IPCC 2013', 'climate change', 'GWP 100a'))]
-    return sorted(methods), sorted(list(bd.databases))
+    with project_context(project):
+        # methods = [", ".join(m) for m in bd.methods if "superseded" not in str(m)]  # TODO uncomment in the end
+        methods = [", ".join(('IPCC 2013', 'climate change', 'GWP 100a'))]
+        return sorted(methods), sorted(list(bd.databases))
 
 
 @app.callback(
     Output('activity', 'options'),
     Input('project', 'value'),
     Input('database', 'value'),
+    Input('method', 'value'),
+    Input('activity', 'search_value'),
+    State('activity', 'value'),
 )
-def get_activities(project, database):
-    if project is None:
+def get_activities(project, database, method, search_value, activity):
+    if (project is None) or (database is None):
         raise PreventUpdate
-    bd.projects.set_current(project)
-    db = bd.Database(database)
-    activities = [f"{act['name']}, {act['location']}" for act in db]
-    return sorted(activities)
+    index = get_activity_index(project, database)
+    found = index.search(search_value, ACTIVITY_SEARCH_LIMIT)
+    # Selected activity has to stay in the options, otherwise the dropdown clears it
+    if (activity is not None) and (activity in index.positions) and all(id_ != activity for id_, _ in found):
+        found = [(activity, index.label(activity))] + found
+    if method is None:
+        return [{"label": label, "value": id_} for id_, label in found]
+    scores = compute_all_scores(project, database, method)
+    return [
+        {"label": f"{label}  [{scores[id_]:.2e}]" if id_ in scores else label, "value": id_} for id_, label in found
+    ]
+
+
+@app.callback(
+    Output('activities-table', 'data'),
+    Output('activities-table', 'page_count'),
+    inputs=dict(
+        project=Input('project', 'value'),
+        database=Input('database', 'value'),
+        method=Input('method', 'value'),
+        page_current=Input('activities-table', 'page_current'),
+        page_size=Input('activities-table', 'page_size'),
+        sort_by=Input('activities-table', 'sort_by'),
+        filter_query=Input('activities-table', 'filter_query'),
+    )
+)
+def update_activities_table(project, database, method, page_current, page_size, sort_by, filter_query):
+    import pandas as pd
+    if (project is None) or (database is None) or (method is None):
+        raise PreventUpdate
+    index = get_activity_index(project, database)
+    scores = compute_all_scores(project, database, method)
+    df = pd.DataFrame({
+        "Activity": [index.label(id_) for id_ in scores.keys()],
+        "LCIA score": list(scores.values()),
+    })
+    df_page, page_count = query_table_gsa_ranking(df, page_current, page_size, sort_by, filter_query)
+    df_page = df_page.assign(**{"LCIA score": df_page["LCIA score"].map(lambda x: f"{x:.3e}")})
+    return df_page.to_dict("records"), page_count
 
 
 @app.callback(
@@ -88,40 +222,40 @@ def compute_deterministic_score_wrapper(lca_config):
 
 @app.callback(
     Output("mc-graph", 'figure'),
-    Output("mc-progress", "value"),
-    Output("mc-progress", "label"),
     Output("mc-state", "data"),
     inputs=dict(
-        n_intervals=Input("mc-interval", "n_intervals"),
+        mc_event=Input("mc-events", "message"),
+        mc_finished=Input("mc-finished", "data"),
         directory=Input("directory", "data"),
         score=Input("score", "children"),
     ),
     state=dict(
         unit=State("method-unit", "children"),
-        mc_finished=State("mc-finished", "data"),
         mc_state=State("mc-state", "data"),
         mc_config=get_mc_config(State),
     ),
 )
-def plot_simulations(n_intervals, directory, score, unit, mc_finished, mc_state, mc_config):
+def plot_simulations(mc_event, mc_finished, directory, score, unit, mc_state, mc_config):
+    check_directories(directory)
     if score is None:
         raise PreventUpdate
     if "score" == ctx.triggered_id:
         fig = plot_mc_simulations(score, unit, iterations=ITERATIONS)
-        return fig, 0, dash.no_update, 0
+        return fig, 0
     if directory is None:
         raise PreventUpdate
     if "directory" == ctx.triggered_id:
         fig = plot_mc_simulations(score, unit, iterations=ITERATIONS)
-        return fig, 0, dash.no_update, 0
-    Y_files = get_Y_files(directory)
-    if mc_finished or (len(Y_files) > mc_state):
-        Y_data = collect_Y(Y_files)
-        fig = plot_mc_simulations(score, unit, Y_data, mc_config["iterations"])
-        progress = len(Y_data) / mc_config['iterations'] * 100
-        return fig, progress, f"{progress:2.0f}%", len(Y_files)
+        return fig, 0
+    Y_reader = get_Y_reader(directory)
+    with Y_reader.lock:
+        n_files = Y_reader.update()
+        mc_histogram = Y_reader.histogram.histogram() if Y_reader.count > 0 else None
+    if (mc_finished or (n_files > mc_state)) and (mc_histogram is not None):
+        fig = plot_mc_simulations(score, unit, iterations=mc_config["iterations"], mc_histogram=mc_histogram)
+        return fig, n_files
     else:
-        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update
 
 
 @app.callback(
@@ -134,10 +268,7 @@ def plot_simulations(n_intervals, directory, score, unit, mc_finished, mc_state,
 def create_directory_wrapper(n_clicks, lca_mc_config):
     if n_clicks == 0:
         raise PreventUpdate
-    iterations, iterations_chunk, seed = lca_mc_config.pop("iterations"), lca_mc_config.pop("iterations_chunk"), lca_mc_config.pop("seed")
-    base_directory = create_directory(lca_mc_config)
-    directory = base_directory / f"iterations{iterations}_chunk{iterations_chunk}_seed{seed}"
-    directory.mkdir(parents=True, exist_ok=True)
+    directory = create_run_directory(lca_mc_config)
     return str(directory)
 
 
@@ -148,100 +279,251 @@ def create_directory_wrapper(n_clicks, lca_mc_config):
         mc_config=get_mc_config(Input),
         n_clicks=State("btn-start-mc", "n_clicks"),
         lca_config=get_lca_config(State),
-    )
+        session=State("session", "data"),
+    ),
+    background=True,
+    progress=[Output("mc-progress", "value"), Output("mc-progress", "label")],
+    cancel=[Input("btn-cancel-mc", "n_clicks")],
+    running=[
+        (Output("btn-start-mc", "disabled"), True, False),
+        (Output("btn-cancel-mc", "disabled"), False, True),
+    ],
 )
-def run_simulations_wrapper(directory, mc_config, n_clicks, lca_config):
+def run_simulations_wrapper(set_progress, directory, mc_config, n_clicks, lca_config, session):
+    check_directories(directory)
     if directory is None:
         raise PreventUpdate
-    if ctx.triggered_id in ["iterations", "iterations-chunk", "seed"]:
+    if ctx.triggered_id in [
+        "iterations", "iterations-chunk", "seed", "sampling", "stopping", "time-budget", "uncertainty",
+    ]:
         return False
     lca_mc_config = {**lca_config, **mc_config}
-    run_simulations_from_X_all(directory, lca_mc_config)
+    clear_detached(directory, session)
+    set_progress((0, "0%"))
+
+    def set_mc_progress(iterations_done, eta=None, pending_writes=0):
+        progress = iterations_done / mc_config['iterations'] * 100
+        label = format_progress(progress, eta)
+        # Computation is ahead of the disk, when the writer queue is full
+        if pending_writes > WRITER_QUEUE_SIZE:
+            label += ", writing"
+        set_progress((progress, label))
+
+    def run():
+        clear_cancel(directory)
+        clear_events(directory)
+        if WORK_QUEUE is not None:
+            return run_simulations_distributed(directory, lca_mc_config, SQLiteBroker(WORK_QUEUE), set_mc_progress)
+        return run_simulations_from_X_all(directory, lca_mc_config, set_mc_progress)
+
+    def on_wait():
+        Y_reader = get_Y_reader(directory)
+        Y_reader.update()
+        set_mc_progress(Y_reader.count)
+        return is_detached(directory, session)
+
+    # Same MC run started from another session is attached to instead of being computed twice
+    finished = run_single_flight(directory, run, on_wait, owner=session)
+    return finished
+
+
+@app.callback(
+    Output("mc-cancelled", "data"),
+    inputs=dict(
+        n_clicks=Input("btn-cancel-mc", "n_clicks"),
+        directory=State("directory", "data"),
+        session=State("session", "data"),
+    ),
+)
+def cancel_simulations(n_clicks, directory, session):
+    check_directories(directory)
+    if n_clicks == 0 or directory is None:
+        raise PreventUpdate
+    cancel_job(directory, session)
     return True
 
 
 @app.callback(
-    Output('mc-interval', 'max_intervals'),
-    Input("btn-start-mc", "n_clicks"),
+    Output("mc-stopping", "children"),
     Input("mc-finished", "data"),
+    State("directory", "data"),
 )
-def toggle_mc_interval(n_clicks, mc_finished):
-    if mc_finished:
-        time.sleep(INTERVAL_TIME)
-        return 2
-    if n_clicks > 0:
-        return 1e5
+def show_stopping_reason(mc_finished, directory):
+    check_directories(directory)
+    if (directory is None) or not mc_finished:
+        return ""
+    # Report is only written by runs that stop when converged or at a deadline
+    report = read_convergence_report(directory)
+    if report is None:
+        return ""
+    if report["reason"] == "converged":
+        return f"Converged after {report['iterations']} iterations"
+    if report["reason"] == "time":
+        return f"Time budget reached after {report['iterations']} iterations"
+    return f"Maximum of {report['iterations']} iterations reached"
+
+
+@app.callback(
+    Output("mc-events", "url"),
+    Input("directory", "data"),
+    Input("mc-finished", "data"),
+    Input("mc-cancelled", "data"),
+)
+def toggle_mc_events(directory, mc_finished, mc_cancelled):
+    # Run wrapper returned, also for jobs that were killed or that this session detached from
+    if (directory is None) or ctx.triggered_id in ["mc-finished", "mc-cancelled"]:
+        return None
+    return get_events_url(directory)
 
 
 @app.callback(
     Output('linearity-graph', 'figure'),
-    Output('ranking-table', 'data'),
     Output('ranking-table', 'columns'),
-    Output('ranking-table', 'style_data_conditional'),
-    Output('sensitivity-indices', 'data'),
+    Output('ranking-directory', 'data'),
+    Output('gsa-directory', 'data'),
     inputs=dict(
-        n_intervals=Input('mc-interval', 'n_intervals'),
-        mc_finished=State("mc-finished", "data"),
+        mc_finished=Input("mc-finished", "data"),
+        previous_run=Input("previous-run", "value"),
         directory=State("directory", "data"),
         lca_config=get_lca_config(State),
         unit=State("method-unit", "children"),
     )
 )
-def plot_sensitivity_results(n_intervals, mc_finished, directory, lca_config, unit):
+def plot_sensitivity_results(mc_finished, previous_run, directory, lca_config, unit):
+    check_directories(directory)
+    if "previous-run" == ctx.triggered_id:
+        if previous_run is None:
+            raise PreventUpdate
+        check_directories(previous_run)
+        results = read_results(previous_run)
+        if results is None:
+            raise PreventUpdate
+        df = read_ranking(previous_run)
+        contribution_column = f"Contribution \n {results['metadata']['unit']}"
+        columns = [{"name": i if "Contribution" not in i else contribution_column, "id": i} for i in df.columns]
+        fig_linearity = plot_model_linearity(results["model_linearity"], LINEARITY_THRESHOLD, ITERATIONS)
+        # Validation keeps the GSA results of the current LCA setup
+        return fig_linearity, columns, str(previous_run), dash.no_update
     if directory is not None:
         directory = Path(directory)
     if mc_finished:
-        project, database, activity, amount, method = lca_config["project"], lca_config["database"], \
-                                                      lca_config["activity"], lca_config["amount"], lca_config["method"]
-        X, Y = collect_XY(directory)
-        indices = read_pickle(directory / "indices.pickle")
-        model_linearity = compute_model_linearity(X, Y)
-        sensitivity_indices, sensitivity_method = compute_sensitivity_indices(X, Y, model_linearity, LINEARITY_THRESHOLD)
-        contributions = contribution_analysis(directory, project, database, activity, amount, method, GT_CUTOFF, GT_MAXCALC)
-        sensitivity_data = collect_sensitivity_results(
-            project, sensitivity_indices, contributions, indices, sensitivity_method,
-        )
-        df = create_table_gsa_ranking(sensitivity_data, PAGE_SIZE)
-        bar_styles_gsa = style_bars_in_datatable(df, 'GSA index', color_bars="#5757E5")
-        bar_styles_ca = style_bars_in_datatable(df, "Contribution", color_bars="#9EC7E4")
-        df_data = df.to_dict("records")
+        model_linearity, _, df = run_sensitivity_analysis(directory, lca_config)
         contribution_column = f"Contribution \n {unit}"
         columns = [{"name": i if "Contribution" not in i else contribution_column, "id": i} for i in df.columns]
         fig_linearity = plot_model_linearity(model_linearity, LINEARITY_THRESHOLD, ITERATIONS)
-        return fig_linearity, df_data, columns, bar_styles_gsa + bar_styles_ca, sensitivity_indices
+        return fig_linearity, columns, str(directory), str(directory)
     else:
-        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+
+@app.callback(
+    Output("previous-run", "options"),
+    Input("mc-finished", "data"),
+)
+def list_previous_runs(mc_finished):
+    options = []
+    for directory, metadata in list_results():
+        label = f"{metadata['activity_name']}, {metadata['activity_location']} | {metadata['method']} | " \
+                f"{metadata['iterations']} iterations | {metadata['run']}"
+        options.append({"label": label, "value": directory})
+    return options
+
+
+@app.callback(
+    Output('ranking-table', 'data'),
+    Output('ranking-table', 'page_count'),
+    Output('ranking-table', 'style_data_conditional'),
+    inputs=dict(
+        ranking_directory=Input('ranking-directory', 'data'),
+        page_current=Input('ranking-table', 'page_current'),
+        page_size=Input('ranking-table', 'page_size'),
+        sort_by=Input('ranking-table', 'sort_by'),
+        filter_query=Input('ranking-table', 'filter_query'),
+    )
+)
+def update_ranking_table(ranking_directory, page_current, page_size, sort_by, filter_query):
+    check_directories(ranking_directory)
+    if ranking_directory is None:
+        raise PreventUpdate
+    df = read_ranking(ranking_directory)
+    df_page, page_count = query_table_gsa_ranking(df, page_current, page_size, sort_by, filter_query)
+    bar_styles_gsa = style_bars_in_datatable(
+        df_page, 'GSA index', color_bars="#5757E5", max_value=df['GSA index'].max()
+    )
+    bar_styles_ca = style_bars_in_datatable(
+        df_page, "Contribution", color_bars="#9EC7E4", max_value=df['Contribution'].max()
+    )
+    styles = get_style_data_conditional(color_even) + bar_styles_gsa + bar_styles_ca
+    return df_page.to_dict("records"), page_count, styles
 
 
 @app.callback(
     Output("val-graph", 'figure'),
     Output("val-state", "data"),
     inputs=dict(
-        n_intervals=Input("val-interval", "n_intervals")
+        val_event=Input("val-events", "message"),
+        val_finished=Input("val-finished", "data"),
+        val_preview=Input("val-preview", "data"),
     ),
     state=dict(
-        val_finished=State("val-finished", "data"),
         val_state=State("val-state", "data"),
         val_directory=State("val-directory", "data"),
         val_min=State('val-min', 'value'),
         val_max=State("val-max", "value")
     ),
 )
-def plot_validation_results(n_intervals, val_finished, val_state, val_directory, val_min, val_max):
-    if "val-interval" == ctx.triggered_id:
+def plot_validation_results(val_event, val_finished, val_preview, val_state, val_directory, val_min, val_max):
+    check_directories(val_directory)
+    val_preview = val_preview or dict()
+    metric_preview, error_preview = val_preview.get("metric"), val_preview.get("error")
+    if "val-preview" == ctx.triggered_id:
+        metric = None
+        if (val_directory is not None) and get_val_state(val_directory) > 0:
+            metric = collect_validation_results(val_directory)
+        fig = plot_validation(val_min, val_max, metric, metric_preview, error_preview)
+        return fig, dash.no_update
+    if "val-events" == ctx.triggered_id:
         val_new_state = get_val_state(val_directory)
         if val_finished or (val_new_state > val_state):
             metric = collect_validation_results(val_directory)
-            fig = plot_validation(min_influential=val_min, max_influential=val_max, metric=metric)
+            fig = plot_validation(val_min, val_max, metric, metric_preview, error_preview)
             return fig, val_new_state
     if val_finished:
         metric = collect_validation_results(val_directory)
-        fig = plot_validation(min_influential=val_min, max_influential=val_max, metric=metric)
+        fig = plot_validation(val_min, val_max, metric, metric_preview, error_preview)
         return fig, dash.no_update
     else:
         return dash.no_update, dash.no_update
 
 
+@app.callback(
+    Output("val-preview", "data"),
+    inputs=dict(
+        n_clicks=Input("btn-preview-val", "n_clicks"),
+        directory=State('directory', 'data'),
+        gsa_directory=State('gsa-directory', 'data'),
+        val_config=get_val_config(State),
+    ),
+)
+def preview_validation_wrapper(n_clicks, directory, gsa_directory, val_config):
+    check_directories(directory, gsa_directory)
+    if n_clicks == 0 or (directory is None) or (gsa_directory is None):
+        raise PreventUpdate
+    sensitivity_indices = get_sensitivity_indices(gsa_directory)
+    if has_X_store(directory):
+        import numpy as np
+        # Inputs beyond the largest influential set are fixed in every preview, only the others are read
+        columns = np.argsort(sensitivity_indices)[-1::-1][:val_config["val_max"]]
+        X, Y = read_X_columns(directory, columns), collect_run_Y(directory)
+        sensitivity_indices = np.array(sensitivity_indices)[columns]
+    else:
+        X, Y = collect_XY(directory)
+    metric, error = predict_validation_surrogate(
+        X, Y, sensitivity_indices, val_config["val_min"], val_config["val_max"], SURROGATE_MODEL, seed=SEED
+    )
+    return dict(metric=metric, error=error)
+
+
 @app.callback(
     Output("val-directory", "data"),
     inputs=dict(
@@ -250,11 +532,11 @@ def plot_validation_results(n_intervals, val_finished, val_state, val_directory,
         val_iterations=State('val-iterations', 'value'),
     ),
 )
-def create_validation_directory(n_clicks, directory, val_iterations):
+def create_validation_directory_wrapper(n_clicks, directory, val_iterations):
+    check_directories(directory)
     if directory is None:
         raise PreventUpdate
-    val_directory = Path(directory) / f"validation_iterations{val_iterations}"
-    val_directory.mkdir(exist_ok=True, parents=True)
+    val_directory = create_validation_directory(directory, val_iterations)
     return str(val_directory)
 
 
@@ -263,29 +545,133 @@ def create_validation_directory(n_clicks, directory, val_iterations):
     inputs=dict(
         val_directory=Input("val-directory", "data"),
         n_clicks=State("btn-start-val", "n_clicks"),
-        sensitivity_indices=State('sensitivity-indices', 'data'),
+        gsa_directory=State('gsa-directory', 'data'),
         val_config=get_val_config(State),
         lca_config=get_lca_config(State),
+        session=State("session", "data"),
+    ),
+    background=True,
+    progress=[Output("val-progress", "value"), Output("val-progress", "label")],
+    cancel=[Input("btn-cancel-val", "n_clicks")],
+    running=[
+        (Output("btn-start-val", "disabled"), True, False),
+        (Output("btn-cancel-val", "disabled"), False, True),
+    ],
+)
+def run_validation_wrapper(set_progress, val_directory, n_clicks, gsa_directory, val_config, lca_config, session):
+    check_directories(val_directory, gsa_directory)
+    if (val_directory is None) or (gsa_directory is None):
+        raise PreventUpdate
+    sensitivity_indices = get_sensitivity_indices(gsa_directory)
+    if val_config["val_target"] is None:
+        # Target input was left empty
+        val_config["val_target"] = VALIDATION_TARGET
+    clear_detached(val_directory, session)
+    set_progress((0, "0%"))
+
+    def set_val_progress(sizes_done, sizes_total, eta=None):
+        progress = min(sizes_done / sizes_total * 100, 100)
+        set_progress((progress, format_progress(progress, eta)))
+
+    def run():
+        clear_cancel(val_directory)
+        clear_events(val_directory)
+        # Adaptive search chooses the next size from the previous ones, so it is not distributed
+        if (WORK_QUEUE is not None) and val_config["val_mode"] != "adaptive":
+            return run_validation_distributed(
+                val_directory, sensitivity_indices, val_config, lca_config, SQLiteBroker(WORK_QUEUE), set_val_progress
+            )
+        return run_validation(val_directory, sensitivity_indices, val_config, lca_config, set_val_progress)
+
+    def on_wait():
+        sizes_total = len(range(val_config["val_min"], val_config["val_max"]+1, val_config["val_step"]))
+        set_val_progress(get_val_state(val_directory), sizes_total)
+        return is_detached(val_directory, session)
+
+    finished = run_single_flight(val_directory, run, on_wait, owner=session)
+    return finished
+
+
+@app.callback(
+    Output("val-cancelled", "data"),
+    inputs=dict(
+        n_clicks=Input("btn-cancel-val", "n_clicks"),
+        val_directory=State("val-directory", "data"),
+        session=State("session", "data"),
     ),
 )
-def run_validation_wrapper(val_directory, n_clicks, sensitivity_indices, val_config, lca_config):
-    if val_directory is None:
+def cancel_validation(n_clicks, val_directory, session):
+    check_directories(val_directory)
+    if n_clicks == 0 or val_directory is None:
         raise PreventUpdate
-    run_validation(val_directory, sensitivity_indices, val_config, lca_config)
+    cancel_job(val_directory, session)
     return True
 
 
 @app.callback(
-    Output('val-interval', 'max_intervals'),
-    Input("btn-start-val", "n_clicks"),
+    Output("val-influential", "children"),
     Input("val-finished", "data"),
+    State("val-directory", "data"),
 )
-def toggle_val_interval(n_clicks, val_finished):
-    if val_finished:
-        time.sleep(INTERVAL_TIME)
+def show_influential(val_finished, val_directory):
+    check_directories(val_directory)
+    if (val_directory is None) or not val_finished:
+        return ""
+    # Minimal influential set is only found by the adaptive search, it is published in its finished event
+    events, _ = read_events(val_directory)
+    finished = [event for event in events if event.get("type") == "finished"]
+    if (not finished) or ("influential" not in finished[-1]):
+        return ""
+    event = finished[-1]
+    if event["influential"] is None:
+        return f"Target correlation {event['target']} is not reached with {event['max_inf']} influential inputs"
+    return f"{event['influential']} influential inputs reach the target correlation {event['target']}"
+
+
+@app.callback(
+    Output("val-events", "url"),
+    Input("val-directory", "data"),
+    Input("val-finished", "data"),
+    Input("val-cancelled", "data"),
+)
+def toggle_val_events(val_directory, val_finished, val_cancelled):
+    # Run wrapper returned, also for jobs that were killed or that this session detached from
+    if (val_directory is None) or ctx.triggered_id in ["val-finished", "val-cancelled"]:
         return None
-    if n_clicks > 0:
-        return 1e5
+    return get_events_url(val_directory)
+
+
+@app.callback(
+    Output("timings-graph", "figure"),
+    Output("throughput", "children"),
+    inputs=dict(
+        n_clicks=Input("btn-refresh-diagnostics", "n_clicks"),
+        mc_finished=Input("mc-finished", "data"),
+        val_finished=Input("val-finished", "data"),
+        directory=State("directory", "data"),
+        val_directory=State("val-directory", "data"),
+    ),
+)
+def plot_diagnostics(n_clicks, mc_finished, val_finished, directory, val_directory):
+    check_directories(directory, val_directory)
+    if directory is None:
+        raise PreventUpdate
+    timings = read_run_timings(directory)
+    val_timings = read_run_timings(val_directory) if val_directory is not None else None
+    throughput = []
+    mc_solve, mc_all = get_throughput(timings, "mc_solve", MC_STAGES)
+    if mc_solve is not None:
+        throughput.append(f"MC: {mc_solve:.1f} iterations/s in solves, {mc_all:.1f} iterations/s overall.")
+    if "pruning" in timings:
+        pruned = timings["pruning"]["items"] // timings["pruning"]["count"]
+        throughput.append(f"Pruning: {pruned} uncertain inputs that cannot change the score are not sampled.")
+    if val_timings:
+        val_solve, val_all = get_throughput(val_timings, "validation_solve", VALIDATION_STAGES)
+        if val_solve is not None:
+            throughput.append(
+                f"Validation: {val_solve:.1f} iterations/s in solves, {val_all:.1f} iterations/s overall."
+            )
+    return plot_stage_timings(timings, val_timings), " ".join(throughput)
 
 
 # TODO add spinner
@@ -302,4 +688,5 @@ def toggle_val_interval(n_clicks, val_finished):
 
 
 if __name__ == '__main__':
-    app.run_server(port=8050, debug=True, processes=4, threaded=False)
+    # Callbacks of users on different Brightway projects take turns on the current project, see `ProjectGate`
+    app.run_server(port=8050, debug=True, threaded=True)
@@ -0,0 +1,78 @@
+import hashlib
+from bisect import bisect_left
+from functools import lru_cache
+
+# Local files
+from .data import CACHE_ROOT, read_json, write_json
+from .metrics import span
+from .projects import project_context
+
+ACTIVITY_INDEX_DIRECTORY = CACHE_ROOT / "activity_index"
+
+
+class ActivityIndex:
+    """Compact searchable index of activity labels `"name, location"` and their ids for one database."""
+
+    def __init__(self, ids, labels):
+        order = sorted(range(len(labels)), key=lambda i: labels[i].lower())
+        self.ids = [ids[i] for i in order]
+        self.labels = [labels[i] for i in order]
+        self.labels_lower = [label.lower() for label in self.labels]
+        self.positions = {id_: i for i, id_ in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def label(self, id_):
+        return self.labels[self.positions[id_]]
+
+    def search(self, query, limit=50):
+        """Return up to `limit` (id, label) pairs, prefix matches first, then labels that contain all query words."""
+        query = (query or "").lower().strip()
+        start = bisect_left(self.labels_lower, query)
+        found = []
+        for i in range(start, len(self.labels_lower)):
+            if len(found) == limit or not self.labels_lower[i].startswith(query):
+                break
+            found.append(i)
+        if len(found) < limit:
+            words = query.split()
+            prefix_found = set(found)
+            for i, label in enumerate(self.labels_lower):
+                if len(found) == limit:
+                    break
+                if i not in prefix_found and all(word in label for word in words):
+                    found.append(i)
+        return [(self.ids[i], self.labels[i]) for i in found]
+
+
+def get_activity_index_file(project, database):
+    import bw2data as bd
+    modified = bd.databases[database].get("modified", "")
+    key = ";".join([project, database, str(modified)]).encode()
+    hash_name = hashlib.blake2b(key=key, digest_size=8).hexdigest()
+    return ACTIVITY_INDEX_DIRECTORY / f"{hash_name}.json"
+
+
+def get_activity_index(project, database):
+    with project_context(project):
+        return load_activity_index(project, database, str(get_activity_index_file(project, database)))
+
+
+@lru_cache(maxsize=16)
+def load_activity_index(project, database, fp):
+    """Activity index is built once per database version and stored in the cache directory."""
+    import bw2data as bd
+    try:
+        data = read_json(fp)
+    except FileNotFoundError:
+        db = bd.Database(database)
+        data = {"ids": [], "labels": []}
+        with span("activity_index") as index_span:
+            for act in db:
+                data["ids"].append(act.id)
+                data["labels"].append(f"{act['name']}, {act['location']}")
+            index_span.items = len(data["ids"])
+        ACTIVITY_INDEX_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        write_json(data, fp)
+    return ActivityIndex(data["ids"], data["labels"])
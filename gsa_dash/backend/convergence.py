@@ -0,0 +1,138 @@
+import numpy as np
+from pathlib import Path
+
+# Local files
+from .data import read_json, write_json
+
+CONVERGENCE_FILE = "convergence.json"
+CONVERGENCE_TOLERANCES = dict(
+    mean=0.01,  # standard error of the mean, relative to the mean
+    percentiles=0.02,  # change of 2.5th and 97.5th percentiles since the previous chunk, relative to their distance
+    ranking=0.1,  # share of the top-k inputs of the Spearman ranking that changed since the previous chunk
+    src=0.02,  # change of the sum of squared standardized regression coefficients since the previous chunk
+)
+TOP_K = 10
+
+
+def append_rows(buffer, n, rows):
+    """Write `rows` after the first `n` rows of `buffer`, which grows by doubling, so that appending is amortized."""
+    if buffer is None:
+        buffer = np.empty((max(2 * len(rows), 1), *rows.shape[1:]), dtype=rows.dtype)
+    elif n + len(rows) > len(buffer):
+        grown = np.empty((max(2 * len(buffer), n + len(rows)), *buffer.shape[1:]), dtype=buffer.dtype)
+        grown[:n] = buffer[:n]
+        buffer = grown
+    buffer[n:n+len(rows)] = rows
+    return buffer
+
+
+def compute_rank_correlations(X, Y):
+    """Spearman correlations of all columns of X with Y at once, constant columns get zero."""
+    from scipy.stats import rankdata
+    RX, RY = rankdata(X, axis=0), rankdata(Y)
+    RX, RY = RX - RX.mean(axis=0), RY - RY.mean()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlations = (RX.T @ RY) / np.sqrt((RX ** 2).sum(axis=0) * (RY ** 2).sum())
+    return np.nan_to_num(correlations)
+
+
+class ConvergenceMonitor:
+    """Running convergence criteria of MC simulations, updated with every chunk.
+
+    MC results are converged when the standard error of the mean is small, and percentiles, top-k ranking of inputs and
+    linearity of the model no longer change between chunks, within `tolerances`. Linearity is checked once there are
+    more iterations than inputs, before that the regression is underdetermined. Without `keep_X`, e.g. for X that does
+    not fit in memory, only running sums of X are kept: inputs are ranked by Pearson correlations and linearity is not
+    checked.
+    """
+
+    def __init__(self, tolerances=None, top_k=TOP_K, keep_X=True):
+        self.tolerances = {**CONVERGENCE_TOLERANCES, **(tolerances or {})}
+        if not keep_X:
+            self.tolerances.pop("src")
+        self.top_k = top_k
+        self.keep_X = keep_X
+        # Chunks are appended to preallocated buffers, X and Y are views of their filled rows
+        self.X_buffer, self.Y_buffer = None, None
+        self.X, self.Y = None, None
+        self.sums = None
+        self.previous = None
+        self.history = []
+
+    @property
+    def iterations(self):
+        return 0 if self.Y is None else len(self.Y)
+
+    def update_sums(self, X_chunk, Y_chunk):
+        """Running sums for Pearson correlations, shifted by the means of the first chunk for numerical stability."""
+        if self.sums is None:
+            self.sums = dict(shift_X=X_chunk.mean(axis=0), shift_Y=Y_chunk.mean(), x=0, xx=0, xy=0, y=0, yy=0)
+        X_chunk = X_chunk - self.sums["shift_X"]
+        Y_chunk = Y_chunk - self.sums["shift_Y"]
+        self.sums["x"] = self.sums["x"] + X_chunk.sum(axis=0)
+        self.sums["xx"] = self.sums["xx"] + (X_chunk ** 2).sum(axis=0)
+        self.sums["xy"] = self.sums["xy"] + X_chunk.T @ Y_chunk
+        self.sums["y"] += Y_chunk.sum()
+        self.sums["yy"] += (Y_chunk ** 2).sum()
+
+    def get_correlations(self):
+        if self.keep_X:
+            return compute_rank_correlations(self.X, self.Y)
+        n, s = len(self.Y), self.sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlations = (n * s["xy"] - s["x"] * s["y"]) / np.sqrt(
+                (n * s["xx"] - s["x"] ** 2) * (n * s["yy"] - s["y"] ** 2)
+            )
+        return np.nan_to_num(correlations)
+
+    def update(self, X_chunk, Y_chunk):
+        """Add chunk of MC results and return True if all criteria are within their tolerances."""
+        from .sensitivity_analysis import compute_src
+        X_chunk, Y_chunk = np.asarray(X_chunk, dtype=float), np.array(Y_chunk)
+        n = self.iterations
+        if self.keep_X:
+            self.X_buffer = append_rows(self.X_buffer, n, X_chunk)
+            self.X = self.X_buffer[:n+len(X_chunk)]
+        else:
+            self.update_sums(X_chunk, Y_chunk)
+        self.Y_buffer = append_rows(self.Y_buffer, n, Y_chunk)
+        self.Y = self.Y_buffer[:n+len(Y_chunk)]
+        Y = self.Y
+        # Regression on fewer iterations than inputs fits exactly, its SRC says nothing about linearity
+        check_src = self.keep_X and (len(Y) > X_chunk.shape[1])
+        mean = np.mean(Y)
+        state = dict(
+            percentiles=np.percentile(Y, [2.5, 97.5]),
+            top_k=set(np.argsort(-np.abs(self.get_correlations()))[:self.top_k].tolist()),
+        )
+        if check_src:
+            state["src"] = compute_src(self.X, Y)
+        criteria = dict(mean=np.std(Y, ddof=1) / np.sqrt(len(Y)) / abs(mean) if mean != 0 else np.inf)
+        if self.previous is not None:
+            width = state["percentiles"][1] - state["percentiles"][0]
+            change = np.max(np.abs(state["percentiles"] - self.previous["percentiles"]))
+            criteria["percentiles"] = change / width if width > 0 else 0.0
+            criteria["ranking"] = 1 - len(state["top_k"] & self.previous["top_k"]) / max(len(state["top_k"]), 1)
+            if check_src and ("src" in self.previous):
+                criteria["src"] = abs(state["src"] - self.previous["src"])
+        self.previous = state
+        self.history.append({"iterations": len(Y), **{k: float(v) for k, v in criteria.items()}})
+        return all(k in criteria and criteria[k] <= tolerance for k, tolerance in self.tolerances.items())
+
+    def get_report(self, reason):
+        return dict(reason=reason, iterations=self.iterations, tolerances=self.tolerances, history=self.history)
+
+
+def write_convergence_report(directory, report):
+    write_json(report, Path(directory) / CONVERGENCE_FILE)
+
+
+def clear_convergence_report(directory):
+    (Path(directory) / CONVERGENCE_FILE).unlink(missing_ok=True)
+
+
+def read_convergence_report(directory):
+    try:
+        return read_json(Path(directory) / CONVERGENCE_FILE)
+    except FileNotFoundError:
+        return None
@@ -1,13 +1,41 @@
 import numpy as np
 import json
 import pickle
+import os
+import tempfile
 from pathlib import Path
 import hashlib
+from functools import lru_cache
+
+CACHE_ROOT = Path.home() / "gsa-dash-cache"
+CANCEL_TOKEN = "cancel.token"
+RANKING_FILE = "gsa_ranking.pickle"
+
+
+def write_atomic(fp, mode):
+    """Open a temporary file next to `fp`, which replaces `fp` only once it is completely written."""
+    fp = Path(fp)
+    # Temporary names have no uppercase letters, so that they are never mistaken for X or Y chunk files
+    h = tempfile.NamedTemporaryFile(mode=mode, dir=fp.parent, prefix=".tmp-", suffix=".part", delete=False)
+    return h, fp
+
+
+def close_atomic(h, fp):
+    h.flush()
+    os.fsync(h.fileno())
+    h.close()
+    os.replace(h.name, fp)
 
 
 def write_json(data, fp):
-    with open(fp, 'w') as h:
+    h, fp = write_atomic(fp, 'w')
+    try:
         json.dump(data, h)
+    except BaseException:
+        h.close()
+        os.remove(h.name)
+        raise
+    close_atomic(h, fp)
 
 
 def read_json(fp):
@@ -17,8 +45,14 @@ def read_json(fp):
 
 
 def write_pickle(data, fp):
-    with open(fp, 'wb') as h:
+    h, fp = write_atomic(fp, 'wb')
+    try:
         pickle.dump(data, h, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        h.close()
+        os.remove(h.name)
+        raise
+    close_atomic(h, fp)
 
 
 def read_pickle(fp):
@@ -28,12 +62,26 @@ def read_pickle(fp):
 
 
 def get_directory_hash(project, database, activity, amount, method):
+    """Directory of an LCA study, activities are hashed by their label "name, location", also when they are given by
+    their id, so that directories of earlier runs are found again.
+    """
+    if isinstance(activity, int):
+        from .activity_index import get_activity_index
+        activity = get_activity_index(project, database).label(activity)
     key = ";".join([project, database, activity, str(amount), str(len(method))]).encode()
     hash_name = hashlib.blake2b(key=key, digest_size=8).hexdigest()
-    directory = Path.home() / "gsa-dash-cache" / str(hash_name)
+    directory = CACHE_ROOT / str(hash_name)
     return directory
 
 
+def is_cache_directory(directory):
+    try:
+        Path(directory).resolve().relative_to(CACHE_ROOT.resolve())
+    except ValueError:
+        return False
+    return Path(directory).is_dir()
+
+
 def create_directory(metadata):
     project, database, activity, amount, method = metadata["project"], metadata["database"], metadata["activity"], \
                                                   metadata["amount"], metadata["method"]
@@ -43,6 +91,38 @@ def create_directory(metadata):
     return directory
 
 
+def create_run_directory(lca_mc_config):
+    """Directory of one MC run, inside the directory of the LCA study."""
+    lca_mc_config = dict(lca_mc_config)
+    iterations, iterations_chunk, seed = lca_mc_config.pop("iterations"), lca_mc_config.pop("iterations_chunk"), \
+        lca_mc_config.pop("seed")
+    sampling = lca_mc_config.pop("sampling", "random")
+    # Runs that stop when converged or at a deadline share chunks with runs of all iterations
+    lca_mc_config.pop("stopping", None)
+    lca_mc_config.pop("time_budget", None)
+    prune = lca_mc_config.pop("prune", True)
+    uncertainty = lca_mc_config.pop("uncertainty", "foreground")
+    base_directory = create_directory(lca_mc_config)
+    name = f"iterations{iterations}_chunk{iterations_chunk}_seed{seed}"
+    # Runs with random sampling keep the directory names from before sampling designs were added
+    if sampling != "random":
+        name += f"_{sampling}"
+    # Pruned chunks have fewer columns in X than chunks of runs from before pruning was added
+    if prune:
+        name += "_pruned"
+    if uncertainty == "all":
+        name += "_background"
+    directory = base_directory / name
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def create_validation_directory(directory, val_iterations):
+    val_directory = Path(directory) / f"validation_iterations{val_iterations}"
+    val_directory.mkdir(exist_ok=True, parents=True)
+    return val_directory
+
+
 def get_Y_files(directory):
     directory = Path(directory)
     files = list(directory.iterdir())
@@ -63,18 +143,31 @@ def collect_Y(Y_files):
 
 
 def collect_XY(directory):
+    """All X and Y chunks of a run in memory, see `backend.x_store` for X that does not fit."""
     directory = Path(directory)
     files = list(directory.iterdir())
     Y_files = sorted([f for f in files if "Y" in f.name and "inf" not in f.name])
     Y, X = [], []
     for Y_file in Y_files:
         X_file = directory / Y_file.name.replace("Y", "X")
-        assert X_file in files
         Y_data = read_json(directory / Y_file)
-        X_data = read_json(directory / X_file)
+        if X_file in files:
+            X_data = read_json(directory / X_file)
+        else:
+            # Runs with background uncertainty keep X chunks in the float32 column store
+            X_file = X_file.with_suffix(".npy")
+            assert X_file in files
+            X_data = np.load(X_file)
         Y = Y + Y_data
-        X = X + X_data
-    return np.array(X), np.array(Y)
+        X.append(np.array(X_data, dtype=float))
+    return (np.vstack(X) if X else np.array(X)), np.array(Y)
+
+
+def collect_run_Y(directory):
+    """All Y chunks of a run, without reading X."""
+    directory = Path(directory)
+    Y_files = sorted([f for f in directory.iterdir() if "Y" in f.name and "inf" not in f.name])
+    return np.array(collect_Y(Y_files))
 
 
 def get_val_state(val_directory):
@@ -94,6 +187,33 @@ def collect_Y_validation(val_directory):
         current_inf = int(Y_file.stem.split("Yinf")[1])
         Y[current_inf] = np.array(Yinf)
         iterations = len(Yinf)  # TODO needs to be implemented better, possibly with a class
-    _, Yall = collect_XY(val_directory.parent)
+    Yall = collect_run_Y(val_directory.parent)
     Y["all"] = Yall[:iterations]
     return Y
+
+
+def request_cancel(directory):
+    (Path(directory) / CANCEL_TOKEN).touch()
+
+
+def clear_cancel(directory):
+    (Path(directory) / CANCEL_TOKEN).unlink(missing_ok=True)
+
+
+def is_cancelled(directory):
+    return (Path(directory) / CANCEL_TOKEN).exists()
+
+
+def write_ranking(df, directory):
+    write_pickle(df, Path(directory) / RANKING_FILE)
+
+
+def read_ranking(directory):
+    """Read GSA ranking table, cached in memory until the file changes."""
+    fp = Path(directory) / RANKING_FILE
+    return read_pickle_cached(str(fp), fp.stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def read_pickle_cached(fp, mtime):
+    return read_pickle(fp)
@@ -0,0 +1,67 @@
+import json
+import time
+from pathlib import Path
+
+# Local files
+from .jobs import get_job_status
+
+EVENTS_FILE = "events.jsonl"
+ENDED_RETRY = 2000  # milliseconds before the browser reconnects to the stream of a job that ended without final event
+
+
+def publish_event(directory, event):
+    """Append a progress event to the event log of a run, it is picked up by `stream_events`."""
+    line = json.dumps(event) + "\n"
+    # Short lines written in append mode are not interleaved between concurrent writers
+    with open(Path(directory) / EVENTS_FILE, "a") as h:
+        h.write(line)
+
+
+def clear_events(directory):
+    (Path(directory) / EVENTS_FILE).unlink(missing_ok=True)
+
+
+def read_events(directory, offset=0):
+    """Read complete events after byte `offset`, returns events and the new offset."""
+    fp = Path(directory) / EVENTS_FILE
+    if not fp.exists():
+        return [], 0
+    if fp.stat().st_size < offset:
+        # Event log was cleared by a new run in the same directory
+        offset = 0
+    if fp.stat().st_size == offset:
+        return [], offset
+    with open(fp, "rb") as h:
+        h.seek(offset)
+        lines = h.readlines()
+    events = []
+    for line in lines:
+        if not line.endswith(b"\n"):
+            break
+        events.append(json.loads(line))
+        offset += len(line)
+    return events, offset
+
+
+def stream_events(directory, offset=0, poll_time=0.2, timeout=15):
+    """Server-sent events with new progress events of a run.
+
+    The stream is closed after `timeout` seconds, and the browser reconnects with the last event id, which is the byte
+    offset in the event log, so that no event is sent twice. The stream is closed at once when the run is finished or
+    cancelled, or when its job ended without a final event, e.g. because it failed or was killed, so that streams of
+    ended runs do not hold a server thread.
+    """
+    yield "retry: 100\n\n"
+    start = time.time()
+    while time.time() - start < timeout:
+        # Status is read before the events, so that all events of a job that ended are sent before the stream closes
+        ended = get_job_status(directory) in ["finished", "cancelled", "failed", "killed"]
+        events, offset = read_events(directory, offset)
+        for event in events:
+            yield f"id: {offset}\ndata: {json.dumps(event)}\n\n"
+        if any(event.get("type") in ["finished", "cancelled"] for event in events):
+            return
+        if ended:
+            yield f"retry: {ENDED_RETRY}\n\n"
+            return
+        time.sleep(poll_time)
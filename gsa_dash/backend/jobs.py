@@ -0,0 +1,130 @@
+import fcntl
+import os
+import socket
+import time
+from pathlib import Path
+
+# Local files
+from .data import read_json, write_json, request_cancel
+
+JOB_LOCK = "job.lock"
+JOB_STATUS = "job.json"
+DETACH_TOKEN = "detach-{session}.token"
+
+
+class JobLock:
+    """Exclusive lock of a run directory, shared by all processes that see the directory.
+
+    The operating system releases the lock when its process dies, so crashed jobs do not block their directory.
+    """
+
+    def __init__(self, directory):
+        self.fp = Path(directory) / JOB_LOCK
+        self.handle = None
+
+    def acquire(self):
+        handle = open(self.fp, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return False
+        self.handle = handle
+        return True
+
+    def release(self):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+
+def is_process_alive(host, pid):
+    """False if process `pid` on `host` is gone, processes on other hosts are assumed to be alive."""
+    if (host != socket.gethostname()) or (pid is None):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_job_status(directory):
+    """Status of the job in `directory`.
+
+    A job whose process was terminated, e.g. by the native cancel of a background callback, never writes its final
+    status, it is reported as "killed" instead of "running".
+    """
+    try:
+        status = read_json(Path(directory) / JOB_STATUS)
+    except FileNotFoundError:
+        return {}
+    if (status.get("status") == "running") and not is_process_alive(status.get("host"), status.get("pid")):
+        status["status"] = "killed"
+    return status
+
+
+def get_job_status(directory):
+    return read_job_status(directory).get("status")
+
+
+def run_single_flight(directory, run, on_wait=None, poll_time=1, owner=None):
+    """Run `run` in `directory` unless the same job is already running there, in which case attach to it.
+
+    Attached callers call `on_wait` every `poll_time` seconds until the running job ends, and get True if it finished.
+    They stop waiting and get False as soon as `on_wait` returns True, e.g. when their session detached. `owner`, e.g.
+    the session that started the job, is written to the job status, so that only it cancels the job, see `cancel_job`.
+    """
+    lock = JobLock(directory)
+    if lock.acquire():
+        try:
+            write_json(
+                {"status": "running", "host": socket.gethostname(), "pid": os.getpid(), "owner": owner},
+                Path(directory) / JOB_STATUS,
+            )
+            try:
+                finished = run()
+            except BaseException:
+                write_json({"status": "failed"}, Path(directory) / JOB_STATUS)
+                raise
+            write_json({"status": "finished" if finished else "cancelled"}, Path(directory) / JOB_STATUS)
+            return finished
+        finally:
+            lock.release()
+    while not lock.acquire():
+        if (on_wait is not None) and on_wait():
+            return False
+        time.sleep(poll_time)
+    lock.release()
+    return get_job_status(directory) == "finished"
+
+
+def cancel_job(directory, session):
+    """Cancel the job in `directory` if `session` started it, otherwise only detach `session` from it.
+
+    Sessions that attached to a running job must not cancel it for the session that started it and for other sessions
+    attached to it.
+    """
+    status = read_job_status(directory)
+    if (status.get("status") == "running") and (status.get("owner") != session):
+        get_detach_file(directory, session).touch()
+    else:
+        request_cancel(directory)
+
+
+def get_detach_file(directory, session):
+    # Sessions come from the browser, only plain hex ids are used in file names
+    if not (isinstance(session, str) and session and set(session) <= set("0123456789abcdef")):
+        raise ValueError(f"Invalid session: {session!r}")
+    return Path(directory) / DETACH_TOKEN.format(session=session)
+
+
+def is_detached(directory, session):
+    return get_detach_file(directory, session).exists()
+
+
+def clear_detached(directory, session):
+    get_detach_file(directory, session).unlink(missing_ok=True)
@@ -1,31 +1,164 @@
-import bw2data as bd
-import bw2calc as bc
+import numpy as np
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# Local files
+from .data import CACHE_ROOT, read_json, write_json
+from .activity_index import get_activity_index
+from .metrics import span
+from .projects import project_context, set_current_project
+
+LCA_CACHE_SIZE = 8
+_LCA_CACHE = OrderedDict()
+# Cached LCA objects switch methods in place, threads hold the lock until they have read their results
+_LCA_CACHE_LOCK = threading.RLock()
+BATCH_SCORES_DIRECTORY = CACHE_ROOT / "batch_scores"
 
 
 def get_bw_activity_and_method(project, database, activity, method):
-    bd.projects.set_current(project)
-    db = bd.Database(database)
-    fu_location = activity.split(", ")[-1]
-    fu_name = activity[:-len(fu_location)-2]
-    fu = [act for act in db if fu_name == act['name'] and fu_location == act['location']]
-    assert len(fu) == 1
-    fu = fu[0]
+    import bw2data as bd
+    set_current_project(project)
+    if isinstance(activity, int):
+        # Activity dropdown values are activity ids
+        fu = bd.get_activity(activity)
+    else:
+        db = bd.Database(database)
+        fu_location = activity.split(", ")[-1]
+        fu_name = activity[:-len(fu_location)-2]
+        fu = [act for act in db if fu_name == act['name'] and fu_location == act['location']]
+        assert len(fu) == 1
+        fu = fu[0]
     method = tuple(method.split(", "))
     return fu, method
 
 
 def create_lca(project, database, activity, amount, method, use_distributions=False, seed=None):
+    import bw2calc as bc
     bw_activity, bw_method = get_bw_activity_and_method(project, database, activity, method)
     lca = bc.LCA({bw_activity: amount}, bw_method, use_distributions=use_distributions, seed_override=seed)
-    lca.lci()
-    lca.lcia()
+    with span("lci"):
+        lca.lci()
+        lca.lcia()
+    return lca
+
+
+def get_database_versions():
+    import bw2data as bd
+    return tuple((name, bd.databases[name].get("modified")) for name in sorted(bd.databases))
+
+
+def get_cached_lca(project, database, activity, method):
+    """Factorized LCA for unit demand of the activity, reused across amounts and methods.
+
+    Cache is keyed by project, activity and modification times of all databases, and holds `LCA_CACHE_SIZE` objects.
+    Callers hold `_LCA_CACHE_LOCK` while they use the returned object.
+    """
+    import bw2calc as bc
+    bw_activity, bw_method = get_bw_activity_and_method(project, database, activity, method)
+    key = (project, bw_activity.id, get_database_versions())
+    lca = _LCA_CACHE.get(key)
+    if lca is None:
+        lca = bc.LCA({bw_activity: 1}, bw_method)
+        with span("lci"):
+            lca.lci(factorize=True)
+            lca.lcia()
+        _LCA_CACHE[key] = lca
+        if len(_LCA_CACHE) > LCA_CACHE_SIZE:
+            _LCA_CACHE.popitem(last=False)
+    else:
+        _LCA_CACHE.move_to_end(key)
+        if tuple(lca.method) != bw_method:
+            lca.switch_method(bw_method)
+            lca.lcia()
     return lca
 
 
 def compute_deterministic_score(
         project, database, activity, amount, method, use_distributions, seed
 ):
-    lca = create_lca(project, database, activity, amount, method, use_distributions, seed)
-    bw_method = lca.method
-    unit = bd.Method(bw_method).metadata.get("unit", "")
-    return lca.score, unit
+    import bw2data as bd
+    with project_context(project):
+        if use_distributions:
+            lca = create_lca(project, database, activity, amount, method, use_distributions, seed)
+            score = lca.score
+        else:
+            # LCIA score is linear in the demanded amount
+            with _LCA_CACHE_LOCK:
+                lca = get_cached_lca(project, database, activity, method)
+                score = lca.score * amount
+        bw_method = tuple(method.split(", "))
+        unit = bd.Method(bw_method).metadata.get("unit", "")
+    return score, unit
+
+
+def compute_all_scores(project, database, method):
+    """Scores of unit demand for every activity in the database, from one solve of the transposed system.
+
+    With characterized biosphere weights w = B^T c, scores of all activities are the entries of lambda in
+    A^T lambda = w at their reference products. A^T is factorized once per cached LCA, so that scores of further methods
+    cost one back substitution. Results are stored per method and database versions.
+    """
+    with project_context(project):
+        key = ";".join([project, database, method, str(get_database_versions())]).encode()
+        hash_name = hashlib.blake2b(key=key, digest_size=8).hexdigest()
+        return load_all_scores(project, database, method, str(BATCH_SCORES_DIRECTORY / f"{hash_name}.json"))
+
+
+def get_transposed_solver(lca):
+    """Factorization of the transposed technosphere matrix, computed once per cached LCA and reused by all methods.
+
+    Callers hold `_LCA_CACHE_LOCK`.
+    """
+    solver = getattr(lca, "transposed_solver", None)
+    if solver is None:
+        from scipy.sparse.linalg import factorized
+        with span("lci"):
+            solver = lca.transposed_solver = factorized(lca.technosphere_matrix.T.tocsc())
+    return solver
+
+
+def get_pruning(project, database, activity, method):
+    """Ids of products and biosphere flows with nonzero score per unit, and of activities with nonzero supply, in the
+    deterministic LCA of the activity, see `get_pruning_masks`.
+
+    Uses the cached factorizations, and is computed once per run, so that all chunks of a run prune the same inputs.
+    """
+    with _LCA_CACHE_LOCK:
+        lca = get_cached_lca(project, database, activity, method)
+        characterization_factors = np.asarray(lca.characterization_matrix.diagonal()).ravel()
+        # Score per unit of every product, from the transposed technosphere system
+        product_scores = get_transposed_solver(lca)(lca.biosphere_matrix.T @ characterization_factors)
+        return dict(
+            products=get_nonzero_ids(lca.dicts.product, product_scores),
+            flows=get_nonzero_ids(lca.dicts.biosphere, characterization_factors),
+            activities=get_nonzero_ids(lca.dicts.activity, lca.supply_array),
+        )
+
+
+def get_nonzero_ids(mapping, values):
+    """Ids of `mapping` from ids to matrix indices whose entries in `values` are nonzero."""
+    ids = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+    positions = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+    return ids[np.asarray(values)[positions] != 0]
+
+
+@lru_cache(maxsize=8)
+def load_all_scores(project, database, method, fp):
+    try:
+        data = read_json(fp)
+    except FileNotFoundError:
+        ids = get_activity_index(project, database).ids
+        with _LCA_CACHE_LOCK:
+            lca = get_cached_lca(project, database, ids[0], method)
+            weights = lca.biosphere_matrix.T @ np.asarray(lca.characterization_matrix.diagonal()).ravel()
+            solve_transposed = get_transposed_solver(lca)
+            with span("batch_scores", items=len(ids)):
+                scores_all = solve_transposed(weights)
+            ids = [id_ for id_ in ids if id_ in lca.dicts.product]
+            scores = [float(scores_all[lca.dicts.product[id_]]) for id_ in ids]
+        data = {"ids": ids, "scores": scores}
+        BATCH_SCORES_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        write_json(data, fp)
+    return dict(zip(data["ids"], data["scores"]))
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class LowRankLCA:
+    """Deterministic LCA that is factorized once and rescored for a few perturbed exchanges.
+
+    Technosphere perturbations are applied with Sherman-Morrison-Woodbury updates of the deterministic solution, and
+    biosphere perturbations are added as dot-product corrections, so that all iterations are computed in one batch.
+    """
+
+    def __init__(self, bw_activity, amount, data_objs):
+        import bw2calc as bc
+        from scipy.sparse.linalg import factorized
+        lca = bc.LCA({bw_activity.id: amount}, data_objs=data_objs, use_distributions=False)
+        lca.lci()
+        lca.lcia()
+        self.lca = lca
+        self.technosphere_matrix = lca.technosphere_matrix.tocsc()
+        self.biosphere_matrix = lca.biosphere_matrix.tocsc()
+        self.characterization_factors = np.asarray(lca.characterization_matrix.diagonal()).ravel()
+        self.solve = factorized(self.technosphere_matrix)
+        self.supply = lca.supply_array
+        self.weights = self.biosphere_matrix.T @ self.characterization_factors
+        self.score = float(self.weights @ self.supply)
+
+    def technosphere_entries(self, indices):
+        rows = np.array([self.lca.dicts.product[i] for i in indices["row"]], dtype=int)
+        cols = np.array([self.lca.dicts.activity[i] for i in indices["col"]], dtype=int)
+        return rows, cols
+
+    def biosphere_entries(self, indices):
+        rows = np.array([self.lca.dicts.biosphere[i] for i in indices["row"]], dtype=int)
+        cols = np.array([self.lca.dicts.activity[i] for i in indices["col"]], dtype=int)
+        return rows, cols
+
+    def compute_scores(self, indices_tech, data_tech, indices_bio, data_bio):
+        """Compute LCIA scores for all iterations at once.
+
+        `data_tech` and `data_bio` have shape (iterations, number of exchanges) and hold new matrix values, where
+        technosphere values are given before flipping the sign, as in `run_validation_step`.
+        """
+        data_tech, data_bio = np.atleast_2d(data_tech), np.atleast_2d(data_bio)
+        iterations = max(len(data_tech), len(data_bio))
+        supply = np.tile(self.supply, (iterations, 1))
+
+        if len(indices_tech) > 0:
+            rows, cols = self.technosphere_entries(indices_tech)
+            delta = -data_tech - np.asarray(self.technosphere_matrix[rows, cols]).ravel()
+            unique_rows, rows_inv = np.unique(rows, return_inverse=True)
+            unique_cols, cols_inv = np.unique(cols, return_inverse=True)
+            # Perturbation of the technosphere matrix is E_rows @ M @ E_cols.T, with small M for each iteration
+            M = np.zeros((iterations, len(unique_rows), len(unique_cols)))
+            np.add.at(M, (slice(None), rows_inv, cols_inv), delta)
+            Z = np.zeros((self.technosphere_matrix.shape[0], len(unique_rows)))
+            for k, row in enumerate(unique_rows):
+                e = np.zeros(self.technosphere_matrix.shape[0])
+                e[row] = 1
+                Z[:, k] = self.solve(e)
+            capacitance = np.eye(len(unique_cols)) + np.einsum("qp,ipr->iqr", Z[unique_cols], M)
+            t = np.linalg.solve(capacitance, supply[:, unique_cols][..., None])[..., 0]
+            supply = supply - np.einsum("np,ipq,iq->in", Z, M, t)
+
+        scores = supply @ self.weights
+        if len(indices_bio) > 0:
+            rows, cols = self.biosphere_entries(indices_bio)
+            delta = data_bio - np.asarray(self.biosphere_matrix[rows, cols]).ravel()
+            scores = scores + np.sum(self.characterization_factors[rows] * delta * supply[:, cols], axis=1)
+        return scores
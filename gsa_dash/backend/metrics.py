@@ -0,0 +1,246 @@
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+# Local files
+from .data import CACHE_ROOT, read_json, write_json
+
+METRICS_DIRECTORY = CACHE_ROOT / "metrics"
+TIMINGS_FILE = "timings.jsonl"
+DUMP_INTERVAL = 1  # seconds between snapshots of the metrics of this process
+SNAPSHOT_TTL = 24 * 60 * 60  # seconds after which snapshots of processes on other hosts are dropped
+HISTOGRAM_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 60, 600)  # upper bounds of span durations in seconds
+MC_STAGES = ("datapackages", "lci", "pruning", "sampling", "mc_solve", "write_chunk", "convergence")
+VALIDATION_STAGES = ("datapackages", "lci", "collect_XY", "low_rank_factorization", "validation_solve")
+
+_run_directory = ContextVar("run_directory", default=None)
+
+
+class Metrics:
+    """Number of calls, total duration, processed items and duration histogram of every stage in this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.dumped_at = 0
+
+    def record(self, stage, seconds, items):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = {"count": 0, "seconds": 0.0, "items": 0, "buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1)}
+                self.stages[stage] = stats
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["items"] += items
+            stats["buckets"][bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+            dump = time.time() - self.dumped_at > DUMP_INTERVAL
+            if dump:
+                self.dumped_at = time.time()
+        if dump:
+            self.dump()
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: {**stats, "buckets": list(stats["buckets"])} for stage, stats in self.stages.items()}
+
+    def dump(self):
+        """Metrics of background callbacks and workers live in other processes, the endpoint reads their snapshots."""
+        METRICS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        write_json(self.snapshot(), get_metrics_file())
+
+
+METRICS = Metrics()
+
+
+def get_metrics_file():
+    return METRICS_DIRECTORY / f"{socket.gethostname()}-{os.getpid()}.json"
+
+
+class Span:
+    """Duration of one stage, added to the metrics of this process and to the timings of the run tracked with
+    `track_run`.
+    """
+
+    def __init__(self, stage, items=1):
+        self.stage = stage
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        METRICS.record(self.stage, seconds, self.items)
+        directory = _run_directory.get()
+        if directory is not None:
+            record_run_timing(directory, self.stage, seconds, self.items)
+        return False
+
+
+def span(stage, items=1):
+    """Time a stage, e.g. `with span("lci"): lca.lci()`.
+
+    Set `items`, e.g. the number of iterations, for the throughput of a stage.
+    """
+    return Span(stage, items)
+
+
+@contextmanager
+def track_run(directory):
+    """Spans inside this block are also written to the timings of the run in `directory`."""
+    token = _run_directory.set(Path(directory))
+    try:
+        yield
+    finally:
+        _run_directory.reset(token)
+        METRICS.dump()
+
+
+def clear_run_timings(directory):
+    """Start the timings of a run from scratch, so that they describe the latest run in `directory` only."""
+    (Path(directory) / TIMINGS_FILE).unlink(missing_ok=True)
+
+
+def record_run_timing(directory, stage, seconds, items):
+    line = json.dumps({"stage": stage, "seconds": seconds, "items": items, "time": time.time()}) + "\n"
+    with open(Path(directory) / TIMINGS_FILE, "a") as h:
+        h.write(line)
+
+
+def read_run_timings(directory):
+    """Number of calls, total duration and processed items of every stage of the run in `directory`."""
+    timings = {}
+    fp = Path(directory) / TIMINGS_FILE
+    if not fp.exists():
+        return timings
+    with open(fp) as h:
+        for line in h:
+            if not line.endswith("\n"):
+                break
+            record = json.loads(line)
+            stats = timings.setdefault(record["stage"], {"count": 0, "seconds": 0.0, "items": 0})
+            stats["count"] += 1
+            stats["seconds"] += record["seconds"]
+            stats["items"] += record["items"]
+    return timings
+
+
+def get_throughput(timings, solve_stage, stages):
+    """Iterations per second of the solves alone, and of all `stages` that the iterations went through."""
+    if solve_stage not in timings or timings[solve_stage]["seconds"] == 0:
+        return None, None
+    iterations = timings[solve_stage]["items"]
+    seconds_all = sum(timings[stage]["seconds"] for stage in stages if stage in timings)
+    return iterations / timings[solve_stage]["seconds"], iterations / seconds_all
+
+
+class Throughput:
+    """Measured items per second of a running job, its ETA and what still fits until the deadline of `time_budget`
+    seconds from now.
+    """
+
+    def __init__(self, time_budget=None):
+        self.deadline = None if time_budget is None else time.perf_counter() + time_budget
+        self.seconds, self.items = 0.0, 0
+
+    def record(self, seconds, items):
+        self.seconds += seconds
+        self.items += items
+
+    @property
+    def rate(self):
+        return self.items / self.seconds if (self.items > 0) and (self.seconds > 0) else None
+
+    def get_seconds_left(self):
+        return None if self.deadline is None else max(self.deadline - time.perf_counter(), 0)
+
+    def get_eta(self, items_left):
+        """Seconds until `items_left` are done, or until the deadline if it comes first, None before measurements."""
+        if self.rate is None:
+            return None
+        eta = items_left / self.rate
+        seconds_left = self.get_seconds_left()
+        return eta if seconds_left is None else min(eta, seconds_left)
+
+    def get_items_fit(self, items):
+        """How many of `items` fit before the deadline, all of them before measurements or without deadline."""
+        if (self.deadline is None) or (self.rate is None):
+            return items
+        return min(items, int(self.rate * self.get_seconds_left()))
+
+    def is_over(self):
+        return (self.deadline is not None) and (time.perf_counter() >= self.deadline)
+
+
+def is_snapshot_stale(fp):
+    """Snapshots of processes that ended on this host, or that were not updated for `SNAPSHOT_TTL` on other hosts."""
+    host, _, pid = fp.stem.rpartition("-")
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+    return time.time() - fp.stat().st_mtime > SNAPSHOT_TTL
+
+
+def collect_metrics():
+    """Metrics of this process and latest snapshots of all other live processes that share the cache.
+
+    Snapshots of processes that ended are deleted, so that workers and background callbacks that come and go do not
+    accumulate files.
+    """
+    own_file = get_metrics_file()
+    snapshots = [METRICS.snapshot()]
+    if METRICS_DIRECTORY.exists():
+        for fp in METRICS_DIRECTORY.glob("*.json"):
+            if fp != own_file:
+                try:
+                    if is_snapshot_stale(fp):
+                        fp.unlink(missing_ok=True)
+                        continue
+                    snapshots.append(read_json(fp))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+    stages = {}
+    for snapshot in snapshots:
+        for stage, stats in snapshot.items():
+            total = stages.setdefault(
+                stage, {"count": 0, "seconds": 0.0, "items": 0, "buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1)}
+            )
+            total["count"] += stats["count"]
+            total["seconds"] += stats["seconds"]
+            total["items"] += stats["items"]
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], stats["buckets"])]
+    return stages
+
+
+def format_prometheus(stages):
+    lines = [
+        "# HELP gsa_dash_stage_seconds Duration of pipeline stages.",
+        "# TYPE gsa_dash_stage_seconds histogram",
+    ]
+    for stage, stats in sorted(stages.items()):
+        cumulative = 0
+        for bound, n in zip(list(HISTOGRAM_BUCKETS) + ["+Inf"], stats["buckets"]):
+            cumulative += n
+            lines.append(f'gsa_dash_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'gsa_dash_stage_seconds_sum{{stage="{stage}"}} {stats["seconds"]}')
+        lines.append(f'gsa_dash_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+    lines += [
+        "# HELP gsa_dash_stage_items_total Items, e.g. MC iterations, processed by pipeline stages.",
+        "# TYPE gsa_dash_stage_items_total counter",
+    ]
+    for stage, stats in sorted(stages.items()):
+        lines.append(f'gsa_dash_stage_items_total{{stage="{stage}"}} {stats["items"]}')
+    return "\n".join(lines) + "\n"
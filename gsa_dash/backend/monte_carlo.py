@@ -1,33 +1,90 @@
-import bw2data as bd
-import bw2calc as bc
-import bw_processing as bwp
 import numpy as np
+import time
+from functools import partial
 from pathlib import Path
 
 # Local files
-from .data import write_json, write_pickle
-from .life_cycle_assessment import get_bw_activity_and_method
+from .convergence import ConvergenceMonitor, write_convergence_report, clear_convergence_report
+from .data import read_json, write_json, write_pickle, is_cancelled
+from .events import publish_event
+from .metrics import span, track_run, clear_run_timings, Throughput
+from .sampling import sample_groups, get_uniform_design, NO_UNCERTAINTY_TYPES
+from .writer import ChunkWriter
+from .x_store import get_X_chunk_file, write_X_chunk, read_X_chunk
+from .life_cycle_assessment import get_bw_activity_and_method, get_pruning
 
+PRUNING_FILE = "pruning.pickle"
 
-def run_simulations_from_X_chunk(project, database, activity, amount, method, iterations, seed):
+
+def run_simulations_from_X_chunk(
+        project, database, activity, amount, method, iterations, seed, cancelled=None, sampling="random", prune=True,
+        background=False, design_seed=None, design_offset=0, design_size=None, pruning=None,
+):
+    """MC simulations of one chunk, returns indices and samples of uncertain inputs, and LCIA scores.
+
+    With a sampling design other than "random", the chunk takes rows `design_offset` to `design_offset + iterations`
+    of one design of `design_size` rows and `design_seed` over the uncertain inputs of both matrices, see
+    `get_chunk_design`.
+
+    With `prune`, uncertain inputs that cannot change the score are neither sampled nor returned, see
+    `get_pruning_masks`. Runs pass the `pruning` of `get_pruning`, computed once, to all their chunks. With
+    `background`, exchanges of background databases are uncertain too. Then exchanges without uncertainty are not
+    returned, since their amounts are the same in every iteration and already in the static datapackages, and samples
+    are a float32 array instead of lists.
+    """
+    import bw2calc as bc
     # Prepare input data
     bw_activity, bw_method = get_bw_activity_and_method(project, database, activity, method)
-    dps_no_bg_unct = get_dps_without_background_uncertainty(bw_method)
+    with span("datapackages"):
+        if background:
+            dps_unct = get_dps_with_uncertainty(bw_method)
+        else:
+            dps_unct = get_dps_without_background_uncertainty(bw_method)
     lca_temp = bc.LCA(
         {bw_activity.id: amount},
-        data_objs=dps_no_bg_unct,
+        data_objs=dps_unct,
         use_distributions=True,
         seed_override=seed,
     )
-    lca_temp.lci()
-    lca_temp.lcia()
+    with span("lci"):
+        lca_temp.lci()
+        lca_temp.lcia()
+    masks = dict()
+    if prune:
+        if pruning is None:
+            pruning = get_pruning(project, database, activity, method)
+        with span("pruning") as pruning_span:
+            masks = get_pruning_masks(lca_temp, pruning)
+            pruning_span.items = sum(int((~mask).sum()) for mask in masks.values())
+    if background:
+        for matrix_type in ["technosphere", "biosphere"]:
+            varying = get_varying_mask(lca_temp, matrix_type)
+            masks[matrix_type] = masks[matrix_type] & varying if matrix_type in masks else varying
     dp_name = "no_background_uncertainty"
-    dp_tech = create_dp_X(lca_temp, iterations, "technosphere", dp_name, seed)
-    dp_bio = create_dp_X(lca_temp, iterations, "biosphere", dp_name, seed)
-    input_data = np.vstack([dp_tech.data[1], dp_bio.data[1]]).T.tolist()
+    with span("sampling", items=iterations):
+        uniforms = dict()
+        if sampling != "random":
+            # One design over the inputs of both matrices, technosphere columns first
+            n_tech = len(get_uncertain_indices(lca_temp, "technosphere"))
+            n_dims = n_tech + len(get_uncertain_indices(lca_temp, "biosphere"))
+            design = get_uniform_design(
+                sampling, iterations, n_dims, seed if design_seed is None else design_seed, design_offset, design_size
+            )
+            uniforms = dict(technosphere=design[:, :n_tech], biosphere=design[:, n_tech:])
+        dp_tech = create_dp_X(
+            lca_temp, iterations, "technosphere", dp_name, seed, mask=masks.get("technosphere"),
+            uniforms=uniforms.get("technosphere"),
+        )
+        dp_bio = create_dp_X(
+            lca_temp, iterations, "biosphere", dp_name, seed, mask=masks.get("biosphere"),
+            uniforms=uniforms.get("biosphere"),
+        )
+    input_data = np.vstack([dp_tech.data[1], dp_bio.data[1]]).T
+    input_data = input_data.astype(np.float32) if background else input_data.tolist()
     input_indices = np.hstack([dp_tech.data[0], dp_bio.data[0]])
     # Run Monte Carlo simulations
-    dps_no_fg_bg_unct = get_dps_without_foreground_background_uncertainty(bw_method)
+    with span("datapackages"):
+        dps_no_fg_bg_unct = get_dps_without_foreground_background_uncertainty(bw_method)
     dps_gsa = dps_no_fg_bg_unct + [dp_tech, dp_bio]
     lca_gsa = bc.LCA(
         {bw_activity.id: amount},
@@ -35,18 +92,74 @@ def run_simulations_from_X_chunk(project, database, activity, amount, method, it
         use_distributions=False,
         use_arrays=True,
     )
-    lca_gsa.lci()
-    lca_gsa.lcia()
+    with span("lci"):
+        lca_gsa.lci()
+        lca_gsa.lcia()
     lca_gsa.keep_first_iteration()
     mc_scores = []
-    for i in range(iterations):
-        next(lca_gsa)
-        mc_scores.append(lca_gsa.score)
+    with span("mc_solve") as solve_span:
+        for i in range(iterations):
+            if (cancelled is not None) and cancelled():
+                return None
+            next(lca_gsa)
+            mc_scores.append(lca_gsa.score)
+            solve_span.items = len(mc_scores)
     return input_indices, input_data, mc_scores
 
 
-def create_dp_X(lca_obj, nsamples, matrix_type, name, seed):
+def get_uncertain_groups(lca_obj, matrix_type):
+    """Resource groups of technosphere or biosphere with uncertain exchanges, in the order of the columns of X."""
+    from matrix_utils.resource_group import FakeRNG
+
+    num_resources = 3
+    if matrix_type == "technosphere":
+        num_resources = 4
+
+    obj = getattr(lca_obj, f"{matrix_type}_mm")
+
+    return [
+        group for group in obj.groups
+        if (not isinstance(group.rng, FakeRNG)) and (not group.empty) and (len(group.package.data) == num_resources)
+    ]
+
+
+def get_uncertain_indices(lca_obj, matrix_type):
+    """Indices of uncertain exchanges of technosphere or biosphere, in the order of the columns of X."""
+    return np.hstack([group.package.data[0] for group in get_uncertain_groups(lca_obj, matrix_type)])
+
+
+def get_varying_mask(lca_obj, matrix_type):
+    """Mask of exchanges in uncertain resource groups that have a distribution, the others are constant."""
+    distributions = np.hstack([group.package.data[2] for group in get_uncertain_groups(lca_obj, matrix_type)])
+    return ~np.isin(distributions["uncertainty_type"], NO_UNCERTAINTY_TYPES)
+
+
+def get_pruning_masks(lca_obj, pruning):
+    """Masks of uncertain technosphere and biosphere exchanges of `lca_obj` that can change the score.
+
+    Exchanges of activities with zero supply are outside of the supply chain of the functional unit. Biosphere flows
+    without characterization factor, and technosphere products whose supply chains emit no characterized flows, have
+    zero score per unit. Changing the amounts of such exchanges does not change the score. Supply and scores are
+    those of the deterministic LCA in `pruning`, see `get_pruning`, exchanges with ids that are not in it are pruned.
+    """
+    masks = dict()
+    for matrix_type, row_ids in [("technosphere", pruning["products"]), ("biosphere", pruning["flows"])]:
+        indices_array = get_uncertain_indices(lca_obj, matrix_type)
+        masks[matrix_type] = np.isin(indices_array["row"], row_ids) & np.isin(
+            indices_array["col"], pruning["activities"]
+        )
+    return masks
 
+
+def create_dp_X(lca_obj, nsamples, matrix_type, name, seed, mask=None, uniforms=None):
+    """Datapackage with `nsamples` samples of uncertain exchanges, drawn by matrix_utils or from `uniforms` of a
+    sampling design, with one row per sample and one column per uncertain exchange.
+
+    Exchanges outside of `mask` are still drawn, so that the samples of the others do not depend on the mask, but are
+    not added to the datapackage.
+    """
+
+    import bw_processing as bwp
     from matrix_utils.resource_group import FakeRNG
 
     dp = bwp.create_datapackage(
@@ -55,35 +168,29 @@ def create_dp_X(lca_obj, nsamples, matrix_type, name, seed):
         sequential=True,
     )
 
-    num_resources = 3
-    if matrix_type == "technosphere":
-        num_resources = 4
-
     obj = getattr(lca_obj, f"{matrix_type}_mm")
 
-    indices_array = np.hstack([
-        group.package.data[0] for group in obj.groups
-        if (not isinstance(group.rng, FakeRNG)) and (not group.empty) and (len(group.package.data) == num_resources)
-    ])
+    indices_array = get_uncertain_indices(lca_obj, matrix_type)
 
-    mask = np.ones(len(indices_array), dtype=bool)
+    if mask is None:
+        mask = np.ones(len(indices_array), dtype=bool)
 
-    data = []
-    np.random.seed(seed)
-    for _ in range(nsamples):
-        next(obj)
-        idata = []
-        for group in obj.groups:
-            if (not isinstance(group.rng, FakeRNG)) and (not group.empty):
-                idata.append(group.rng.random_data)
-        data.append(np.hstack(idata)[mask])
-    data_array = np.vstack(data).T
+    if uniforms is None:
+        # Filled in place, so that samples of many inputs are held in memory only once
+        data_array = np.empty((int(mask.sum()), nsamples))
+        np.random.seed(seed)
+        for j in range(nsamples):
+            next(obj)
+            idata = []
+            for group in obj.groups:
+                if (not isinstance(group.rng, FakeRNG)) and (not group.empty):
+                    idata.append(group.rng.random_data)
+            data_array[:, j] = np.hstack(idata)[mask]
+    else:
+        data_array = sample_groups(get_uncertain_groups(lca_obj, matrix_type), uniforms)[mask]
 
     if matrix_type == "technosphere":
-        flip_array = np.hstack([
-            group.flip for group in obj.groups
-            if (not isinstance(group.rng, FakeRNG)) and (not group.empty) and (len(group.package.data) == num_resources)
-        ])
+        flip_array = np.hstack([group.flip for group in get_uncertain_groups(lca_obj, matrix_type)])
         dp.add_persistent_array(
             matrix=f"{matrix_type}_matrix",
             data_array=data_array,
@@ -104,12 +211,23 @@ def create_dp_X(lca_obj, nsamples, matrix_type, name, seed):
 
 def find_background_databases():
     """TODO definitely need to find a better way of finding bg databases."""
+    import bw2data as bd
     dbs = [name for name in bd.databases if "ecoinvent" in name]
     assert len(dbs) == 1
     return dbs
 
 
+def get_dps_with_uncertainty(method):
+    import bw2data as bd
+    me = bd.Method(method).datapackage()
+    dps = [me]
+    for database in bd.databases:
+        dps.append(bd.Database(database).datapackage())
+    return dps
+
+
 def get_dps_without_background_uncertainty(method):
+    import bw2data as bd
     me = bd.Method(method).datapackage()
     background = find_background_databases()
     dps = [me]
@@ -122,6 +240,7 @@ def get_dps_without_background_uncertainty(method):
 
 
 def get_dps_without_foreground_background_uncertainty(method):
+    import bw2data as bd
     me = bd.Method(method).datapackage()
     bs = bd.Database("biosphere3").datapackage()
     dps = [me, bs]
@@ -133,27 +252,139 @@ def get_dps_without_foreground_background_uncertainty(method):
     return dps
 
 
-def run_simulations_from_X_all(directory, lca_mc_config):
-    project, database, activity, amount, method, iterations, iterations_chunk, seed = lca_mc_config["project"], \
-        lca_mc_config["database"], lca_mc_config["activity"], lca_mc_config["amount"],  lca_mc_config["method"], \
-        lca_mc_config["iterations"], lca_mc_config["iterations_chunk"], lca_mc_config["seed"]
-    directory = Path(directory)
+def get_chunks(iterations, iterations_chunk, seed):
+    """Index, number of iterations and random seed of each chunk of MC simulations."""
     np.random.seed(seed)
     n_chunks = int(np.ceil(iterations/iterations_chunk))
     chunk_seeds = np.random.randint(1, np.iinfo(np.int32).max, n_chunks)
-    fpI = directory / f"indices.pickle"
+    chunks = []
     for i in range(n_chunks):
-        fpY = directory / f"Y{i:03d}.json"  # TODO: 3 is the number of leading zeros in file names, at the moment hardcoded
-        fpX = directory / f"X{i:03d}.json"
         if i == n_chunks - 1:
             iterations_chunk = int(min(iterations_chunk, iterations - (n_chunks-1)*iterations_chunk))
-        if (not fpY.exists()) or (not fpI.exists()):
-            input_indices, input_data, mc_scores = run_simulations_from_X_chunk(
-                project, database, activity, amount, method, iterations_chunk, chunk_seeds[i]
-            )
-            write_json(mc_scores, fpY)
+        chunks.append((i, iterations_chunk, int(chunk_seeds[i])))
+    return chunks
+
+
+def get_chunk_design(lca_mc_config, chunk):
+    """Seed, first row and number of rows of the sampling design of the whole run, of which `chunk` takes a block."""
+    return dict(
+        design_seed=lca_mc_config["seed"],
+        design_offset=chunk * lca_mc_config["iterations_chunk"],
+        design_size=lca_mc_config["iterations"],
+    )
+
+
+def run_simulations_from_X_all(directory, lca_mc_config, set_progress=None):
+    """Run MC simulations chunk by chunk, skipping chunks that were already computed.
+
+    Returns False if the run was cancelled with a cancel token in `directory`. Chunks are only written once complete,
+    so that a cancelled run can be resumed. `set_progress` is called with the number of finished iterations, the
+    estimated seconds left and the number of pending chunk writes. With `stopping` "converged" in `lca_mc_config`,
+    iterations are a maximum budget and the run stops as soon as the convergence criteria are met. With `time_budget`
+    in minutes, the last chunk is shortened to the measured throughput, so that the run finishes at the deadline. The
+    reason to stop is written to the convergence report in `directory`. Chunks are written by a `ChunkWriter` while
+    the next chunk is computed, chunk events report the writes that are pending and the seconds computation was
+    blocked by them.
+    """
+    project, database, activity, amount, method, iterations, iterations_chunk, seed = lca_mc_config["project"], \
+        lca_mc_config["database"], lca_mc_config["activity"], lca_mc_config["amount"],  lca_mc_config["method"], \
+        lca_mc_config["iterations"], lca_mc_config["iterations_chunk"], lca_mc_config["seed"]
+    sampling = lca_mc_config.get("sampling", "random")
+    prune = lca_mc_config.get("prune", True)
+    # X with background uncertainty is written to the column store, and does not have to fit in memory
+    background = lca_mc_config.get("uncertainty", "foreground") == "all"
+    monitor = ConvergenceMonitor(keep_X=not background) if lca_mc_config.get("stopping") == "converged" else None
+    time_budget = lca_mc_config.get("time_budget")
+    throughput = Throughput(time_budget * 60 if time_budget else None)
+    directory = Path(directory)
+    clear_convergence_report(directory)
+    clear_run_timings(directory)
+    fpI = directory / f"indices.pickle"
+    iterations_done = 0
+    reason = "budget"
+    with track_run(directory), ChunkWriter() as writer:
+        pruning = get_pruning(project, database, activity, method) if prune else None
+        for i, iterations_chunk, chunk_seed in get_chunks(iterations, iterations_chunk, seed):
+            if is_cancelled(directory):
+                reason = "cancelled"
+                break
+            fpY = directory / f"Y{i:03d}.json"  # TODO: 3 is the number of leading zeros in file names, hardcoded
+            fpX = get_X_chunk_file(directory, i, store=background)
+            input_data, mc_scores = None, None
+            if fpY.exists() and fpI.exists():
+                mc_scores = read_json(fpY)
+                # Chunks that were shortened by a time budget are computed again in full
+                if len(mc_scores) < iterations_chunk:
+                    mc_scores = None
+            if mc_scores is None:
+                iterations_fit = throughput.get_items_fit(iterations_chunk)
+                if iterations_fit == 0:
+                    reason = "time"
+                    break
+                start = time.perf_counter()
+                # Same chunk seed and design rows, so that a shortened chunk has the first iterations of the full chunk
+                results = run_simulations_from_X_chunk(
+                    project, database, activity, amount, method, iterations_fit, chunk_seed,
+                    cancelled=lambda: is_cancelled(directory), sampling=sampling, prune=prune, background=background,
+                    pruning=pruning, **get_chunk_design(lca_mc_config, i),
+                )
+                if results is None:
+                    reason = "cancelled"
+                    break
+                input_indices, input_data, mc_scores = results
+                throughput.record(time.perf_counter() - start, iterations_fit)
+            iterations_done += len(mc_scores)
+            eta = throughput.get_eta(iterations - iterations_done)
+            event = {
+                "type": "chunk", "chunk": i, "iterations": iterations_done, "total": iterations, "eta": eta,
+                "pending_writes": writer.pending, "blocked_seconds": writer.blocked_seconds,
+            }
+            # The chunk is written while the next one is computed, and its event is published once the Y file exists
+            if input_data is None:
+                blocked = writer.submit(partial(publish_event, directory, event))
+            else:
+                blocked = writer.submit(partial(
+                    write_chunk, fpX, fpI, fpY, input_indices, input_data, mc_scores, background, directory, event,
+                ))
+            # Time blocked on a full queue is part of the throughput, so that ETAs account for slow disks
+            throughput.record(blocked, 0)
+            if set_progress is not None:
+                set_progress(iterations_done, eta, writer.pending)
+            if monitor is not None:
+                if input_data is None:
+                    input_data = read_X_chunk(fpX)
+                with span("convergence"):
+                    converged = monitor.update(input_data, mc_scores)
+                if converged:
+                    reason = "converged"
+                    break
+            if len(mc_scores) < iterations_chunk:
+                reason = "time"
+                break
+    if reason == "cancelled":
+        publish_event(directory, {"type": "cancelled"})
+        return False
+    if (monitor is None) and (throughput.deadline is None):
+        publish_event(directory, {"type": "finished"})
+    else:
+        report = monitor.get_report(reason) if monitor is not None else dict(reason=reason, iterations=iterations_done)
+        write_convergence_report(directory, report)
+        publish_event(directory, {"type": "finished", "reason": reason, "iterations": iterations_done})
+    return True
+
+
+def write_chunk(fpX, fpI, fpY, input_indices, input_data, mc_scores, background, directory, event):
+    """Write X, indices and Y of a chunk and publish its `event`, Y files mark complete chunks, hence they are written
+    last.
+    """
+    with span("write_chunk"):
+        if background:
+            write_X_chunk(input_data, fpX)
+        else:
             write_json(input_data, fpX)
-            write_pickle(input_indices, fpI)
+        write_pickle(input_indices, fpI)
+        write_json(mc_scores, fpY)
+    publish_event(directory, event)
 
 
 # def run_simulations_random(directory, project, database, activity, amount, method, iterations, seed, chunksize):
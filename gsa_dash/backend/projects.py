@@ -0,0 +1,85 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class ProjectGate:
+    """Current Brightway project of this process, shared by the threads that use it.
+
+    Brightway has one current project per process, with one SQLite database that is reopened on every switch. Threads
+    that use the current project enter at once and share its open database. A thread that needs another project waits
+    until all threads of the current project have left, and threads that arrive meanwhile for the current project
+    wait behind it, so that no project starves. Contexts of the same project can be nested in one thread.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.current = None
+        self.users = 0
+        self.waiting = Counter()
+        self.local = threading.local()
+
+    def get_held(self):
+        """Project of the innermost context of this thread, None outside of contexts."""
+        return getattr(self.local, "project", None)
+
+    def can_enter(self, project):
+        others_waiting = sum(n for p, n in self.waiting.items() if p != project)
+        if self.users == 0:
+            # Threads that wait for another project go first once the current project is free
+            return (self.current != project) or (others_waiting == 0)
+        return (self.current == project) and (others_waiting == 0)
+
+    def switch(self, project):
+        import bw2data as bd
+        # Switching to the current project also reopens its database, hence it is skipped
+        if (self.current != project) or (bd.projects.current != project):
+            bd.projects.set_current(project)
+        self.current = project
+
+    @contextmanager
+    def use(self, project):
+        held = self.get_held()
+        if held is not None:
+            if held != project:
+                raise RuntimeError(f"Project '{project}' is used inside the context of project '{held}'")
+            yield
+            return
+        with self.condition:
+            self.waiting[project] += 1
+            try:
+                self.condition.wait_for(lambda: self.can_enter(project))
+            finally:
+                self.waiting[project] -= 1
+            if self.users == 0:
+                self.switch(project)
+            self.users += 1
+        self.local.project = project
+        try:
+            yield
+        finally:
+            self.local.project = None
+            with self.condition:
+                self.users -= 1
+                self.condition.notify_all()
+
+
+PROJECTS = ProjectGate()
+
+
+def project_context(project):
+    """Use Brightway `project` in this thread, e.g. `with project_context(project): bd.get_activity(id_)`.
+
+    Brightway objects of the project should not be used after the block, since another thread may switch the project.
+    """
+    return PROJECTS.use(project)
+
+
+def set_current_project(project):
+    """Switch to `project` in code that runs one task per process at a time, e.g. background jobs and workers.
+
+    Inside a context of `project` nothing changes, so that functions that take the project can be called from
+    threaded callbacks too.
+    """
+    with PROJECTS.use(project):
+        pass
@@ -0,0 +1,76 @@
+import numpy as np
+import json
+import time
+from pathlib import Path
+
+# Local files
+from .data import CACHE_ROOT, RANKING_FILE, read_json, write_json, get_Y_files
+
+RESULTS_FILE = "gsa_results.json"
+RESULTS_SUMMARY_FILE = "gsa_summary.json"  # small metadata of the results, listed without reading the results
+RESULTS_VERSION = 1  # artifacts of other versions are computed again
+
+
+def get_results_fingerprint(directory):
+    """Names and modification times of Y chunks, results of a run whose chunks were added or rewritten are stale."""
+    return [[f.name, f.stat().st_mtime_ns] for f in get_Y_files(directory)]
+
+
+def write_results(directory, model_linearity, sensitivity_indices, sensitivity_method, contributions, metadata):
+    """Persist GSA results of a finished run, so that it is reopened without computing GSA again."""
+    results = dict(
+        version=RESULTS_VERSION,
+        created=time.time(),
+        fingerprint=get_results_fingerprint(directory),
+        metadata=metadata,
+        model_linearity=[[int(iterations), float(src)] for iterations, src in model_linearity.items()],
+        sensitivity_indices=[float(s) for s in sensitivity_indices],
+        sensitivity_method=sensitivity_method,
+        contributions=[[int(row), int(col), float(c)] for (row, col), c in contributions.items()],
+    )
+    write_json(results, Path(directory) / RESULTS_FILE)
+    # Summary is written last, so that every listed run has its results
+    summary = {key: results[key] for key in ["version", "created", "metadata"]}
+    write_json(summary, Path(directory) / RESULTS_SUMMARY_FILE)
+
+
+def read_results(directory):
+    """GSA results of `directory`, None if they are missing, of another version or stale."""
+    directory = Path(directory)
+    try:
+        results = read_json(directory / RESULTS_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if results.get("version") != RESULTS_VERSION or not (directory / RANKING_FILE).exists():
+        return None
+    if results["fingerprint"] != get_results_fingerprint(directory):
+        return None
+    results["model_linearity"] = {iterations: src for iterations, src in results["model_linearity"]}
+    results["sensitivity_indices"] = np.array(results["sensitivity_indices"])
+    results["contributions"] = {(row, col): c for row, col, c in results["contributions"]}
+    return results
+
+
+def list_results():
+    """Directories and metadata of all runs in the cache with GSA results, most recent first.
+
+    Only the summaries are read, results are checked for staleness when a run is opened with `read_results`. Results
+    written before summaries existed get their summary once.
+    """
+    for fp in CACHE_ROOT.glob(f"*/*/{RESULTS_FILE}"):
+        if not (fp.parent / RESULTS_SUMMARY_FILE).exists():
+            try:
+                results = read_json(fp)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            summary = {key: results.get(key) for key in ["version", "created", "metadata"]}
+            write_json(summary, fp.parent / RESULTS_SUMMARY_FILE)
+    runs = []
+    for fp in CACHE_ROOT.glob(f"*/*/{RESULTS_SUMMARY_FILE}"):
+        try:
+            summary = read_json(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        if summary.get("version") == RESULTS_VERSION:
+            runs.append((summary["created"], str(fp.parent), summary["metadata"]))
+    return [(directory, metadata) for _, directory, metadata in sorted(runs, reverse=True)]
@@ -0,0 +1,86 @@
+import numpy as np
+import warnings
+
+SAMPLING_DESIGNS = {
+    "random": "Random",
+    "sobol": "Sobol'",
+    "halton": "Halton",
+    "lhs": "Latin hypercube",
+}
+NO_UNCERTAINTY_TYPES = [0, 1]  # undefined and no uncertainty in stats_arrays
+LOGNORMAL_TYPE = 2
+EPSILON = 1e-12  # uniforms are kept inside (0, 1), where inverse CDFs of unbounded distributions are finite
+LHS_BLOCK_SIZE = 1024  # columns of a Latin hypercube that are generated at once
+
+
+def get_uniform_design(design, n_samples, n_dims, seed, offset=0, size=None):
+    """Uniforms of shape (n_samples, n_dims) from a scrambled low-discrepancy sequence or Latin hypercube.
+
+    The rows are rows `offset` to `offset + n_samples` of one design of `size` rows, so that the chunks of a run
+    together form the design of the whole run.
+    """
+    from scipy.stats import qmc
+    size = offset + n_samples if size is None else size
+    if design == "lhs":
+        return np.clip(get_latin_hypercube_rows(n_dims, size, offset, n_samples, seed), EPSILON, 1 - EPSILON)
+    rng = np.random.default_rng(seed)
+    if design == "sobol":
+        sampler = qmc.Sobol(n_dims, scramble=True, seed=rng)
+        if (offset + n_samples == size) and (size & (size - 1) != 0):
+            warnings.warn(f"Balance properties of Sobol' points require a power of 2 iterations, not {size}.")
+    elif design == "halton":
+        sampler = qmc.Halton(n_dims, scramble=True, seed=rng)
+    else:
+        raise ValueError(f"Unknown sampling design: {design}")
+    if offset > 0:
+        sampler.fast_forward(offset)
+    with warnings.catch_warnings():
+        # Chunks are not balanced on their own, only the whole run is, which is checked above
+        warnings.simplefilter("ignore", UserWarning)
+        uniforms = sampler.random(n_samples)
+    return np.clip(uniforms, EPSILON, 1 - EPSILON)
+
+
+def get_latin_hypercube_rows(n_dims, size, offset, n_samples, seed, block_size=LHS_BLOCK_SIZE):
+    """Rows of a Latin hypercube of `size` rows, generated in blocks of columns that each have their own seed.
+
+    Every chunk generates the same permutations, so that only a block of the whole design is in memory at once.
+    """
+    uniforms = np.empty((n_samples, n_dims))
+    seed = list(np.atleast_1d(seed))
+    for k, start in enumerate(range(0, n_dims, block_size)):
+        width = min(block_size, n_dims - start)
+        rng = np.random.default_rng(seed + [k])
+        strata = rng.permuted(np.tile(np.arange(size), (width, 1)), axis=1).T
+        uniforms[:, start:start+width] = ((strata + rng.random((size, width))) / size)[offset:offset+n_samples]
+    return uniforms
+
+
+def sample_inverse_cdf(params, amounts, uniforms):
+    """Values of shape (len(params), n_samples) from stats_arrays parameters and uniforms of shape (n_samples, n_dims).
+
+    Exchanges without uncertainty keep their amounts, lognormal exchanges keep the sign of negative amounts.
+    """
+    from stats_arrays import uncertainty_choices
+    uncertainty_types = params["uncertainty_type"]
+    samples = np.tile(amounts.reshape(-1, 1), (1, uniforms.shape[0])).astype(float)
+    for uncertainty_type in np.unique(uncertainty_types):
+        if uncertainty_type in NO_UNCERTAINTY_TYPES:
+            continue
+        rows = uncertainty_types == uncertainty_type
+        distribution = uncertainty_choices[int(uncertainty_type)]
+        samples[rows] = distribution.ppf(params[rows], uniforms[:, rows].T)
+    negative = (uncertainty_types == LOGNORMAL_TYPE) & params["negative"]
+    samples[negative] = -np.abs(samples[negative])
+    return samples
+
+
+def sample_groups(groups, uniforms):
+    """Samples of all exchanges of resource groups of a matrix_utils mapped matrix, in the order of the groups.
+
+    `uniforms` have one column per exchange, e.g. the columns of a design of the whole run that belong to the groups.
+    """
+    # Same resources that matrix_utils draws random numbers from, amounts are in data[1] and distributions in data[2]
+    params = np.hstack([group.package.data[2] for group in groups])
+    amounts = np.hstack([group.package.data[1] for group in groups])
+    return sample_inverse_cdf(params, amounts, uniforms)
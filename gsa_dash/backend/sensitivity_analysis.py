@@ -1,13 +1,15 @@
 import numpy as np
-import bw2data as bd
-import bw2calc as bc
 from pathlib import Path
-from scipy.stats import spearmanr
-from sklearn.linear_model import LinearRegression
 
 # Local files
+from .convergence import compute_rank_correlations
 from .data import read_json, write_json
 from .life_cycle_assessment import create_lca
+from .metrics import span
+from .projects import set_current_project
+from .x_store import iter_X_blocks, read_X_columns
+
+LINEARITY_MAX_INPUTS = 1000  # inputs in the regression of out-of-core model linearity
 
 
 def compute_model_linearity(X, Y):
@@ -25,6 +27,7 @@ def compute_model_linearity(X, Y):
 
 def compute_src(X, Y):
     """Standardized regression coefficients."""
+    from sklearn.linear_model import LinearRegression
     X, Y = np.array(X), np.array(Y)
     reg = LinearRegression().fit(X, Y)
     # High reg.score in linear regression means that the model performs well on the train and test data.
@@ -38,15 +41,18 @@ def compute_src(X, Y):
 def compute_sensitivity_indices(X, Y, linearity, linearity_threshold):
     src = list(linearity.values())[-1]
     if src > linearity_threshold:
-        S = compute_spearman_coefficients(X, Y)
+        with span("spearman"):
+            S = compute_spearman_coefficients(X, Y)
         sensitivity_method = "Spearman correlations"
     else:
-        S = compute_gradient_boosting_importances(X, Y)
+        with span("gradient_boosting"):
+            S = compute_gradient_boosting_importances(X, Y)
         sensitivity_method = "Gradient boosting"
     return S, sensitivity_method
 
 
 def compute_spearman_coefficients(X, Y):
+    from scipy.stats import spearmanr
     spearman = []
     for x in X.T:
         if len(set(x)) != 1:
@@ -62,6 +68,59 @@ def compute_gradient_boosting_importances(X, Y):
     return np.zeros(X.shape[1])
 
 
+def compute_pearson_correlations(X, Y):
+    """Pearson correlations of all columns of X with Y at once, constant columns get zero."""
+    X, Y = X - X.mean(axis=0), Y - Y.mean()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlations = (X.T @ Y) / np.sqrt((X ** 2).sum(axis=0) * (Y ** 2).sum())
+    return np.nan_to_num(correlations)
+
+
+def compute_model_linearity_blockwise(directory, Y):
+    """Same as `compute_model_linearity` for X in the column store of `directory`, read block by block.
+
+    The regression on all inputs would need all of X in memory, so at every number of iterations it uses the inputs
+    with the highest absolute Pearson correlations with Y. At most a tenth of the iterations, and at most
+    `LINEARITY_MAX_INPUTS`, are used, which keeps the overfitting of the regression small.
+    """
+    iterations_all = len(Y)
+    n_chunks = 10
+    chunk_size = iterations_all//n_chunks
+    iterations_spaced = np.arange(chunk_size, iterations_all, chunk_size)
+    top = {iterations: (np.array([], dtype=int), np.array([])) for iterations in iterations_spaced}
+    for start, block in iter_X_blocks(directory, rows=iterations_all):
+        for iterations in iterations_spaced:
+            k = max(min(iterations // 10, LINEARITY_MAX_INPUTS), 1)
+            correlations = np.abs(compute_pearson_correlations(block[:iterations], Y[:iterations]))
+            columns = np.hstack([top[iterations][0], start + np.arange(block.shape[1])])
+            scores = np.hstack([top[iterations][1], correlations])
+            keep = np.argsort(-scores)[:k]
+            top[iterations] = columns[keep], scores[keep]
+    model_linearity = dict()
+    for iterations in iterations_spaced:
+        Xi = read_X_columns(directory, np.sort(top[iterations][0]), iterations)
+        model_linearity[iterations] = compute_src(Xi, Y[:iterations])
+    return model_linearity
+
+
+def compute_sensitivity_indices_blockwise(directory, Y, linearity, linearity_threshold):
+    """Same as `compute_sensitivity_indices` for X in the column store of `directory`, read block by block."""
+    src = list(linearity.values())[-1]
+    if src > linearity_threshold:
+        with span("spearman"):
+            correlations = np.hstack([
+                compute_rank_correlations(block, Y) for _, block in iter_X_blocks(directory, rows=len(Y))
+            ])
+            S = correlations**2 / sum(correlations**2)
+        sensitivity_method = "Spearman correlations"
+    else:
+        with span("gradient_boosting"):
+            n_inputs = sum(block.shape[1] for _, block in iter_X_blocks(directory, rows=1))
+            S = np.zeros(n_inputs)
+        sensitivity_method = "Gradient boosting"
+    return S, sensitivity_method
+
+
 def contribution_analysis(directory, project, database, activity, amount, method, cutoff=0.005, max_calc=1e5):
     lca = create_lca(project, database, activity, amount, method)
     contributions_tech = contribution_analysis_technosphere(directory, lca, cutoff, max_calc)
@@ -70,13 +129,15 @@ def contribution_analysis(directory, project, database, activity, amount, method
 
 
 def contribution_analysis_technosphere(directory, lca, cutoff=0.005, max_calc=1e5):
+    import bw2calc as bc
     directory = Path(directory)
     contribution_file = directory.parent / f"graph_traversal_cutoff{cutoff:4.3e}_maxcalc{max_calc:4.3e}.json"
     if contribution_file.exists():
         res = read_json(contribution_file)
     else:
         gt = bc.graph_traversal.AssumedDiagonalGraphTraversal()
-        res = gt.calculate(lca, cutoff=cutoff, max_calc=max_calc)
+        with span("graph_traversal"):
+            res = gt.calculate(lca, cutoff=cutoff, max_calc=max_calc)
         write_json(res, contribution_file)
     contributions = dict()
     for edge in res["edges"]:
@@ -88,7 +149,8 @@ def contribution_analysis_technosphere(directory, lca, cutoff=0.005, max_calc=1e
 
 
 def collect_sensitivity_results(project, S, C, indices, sensitivity_method="GSA index"):
-    bd.projects.set_current(project)
+    import bw2data as bd
+    set_current_project(project)
     row_act_names, row_act_locations, row_act_categories = [], [], []
     col_act_names, col_act_locations, static_data = [], [], []
     types, amounts, units = [], [], []
@@ -0,0 +1,168 @@
+import numpy as np
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Local files
+from .data import read_json
+
+
+class StreamingHistogram:
+    """Histogram with a fixed number of fine bins over the bulk of the values, and the values of both tails kept exactly.
+
+    Bins are sized from robust percentiles of the first values, so that a few extreme values do not widen them. The
+    range doubles by merging pairs of bins only when a tail holds more than `tail_fraction` of all values, hence
+    percentiles between the tail fractions are approximated within one bin width of the bulk, and percentiles in the
+    tails are exact. Counts and quantiles are updated in O(new values + bins + tail values).
+    """
+
+    def __init__(self, num_bins=2048, tail_fraction=0.01):
+        assert num_bins % 2 == 0
+        self.num_bins = num_bins
+        self.tail_fraction = tail_fraction
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.below, self.above = np.empty(0), np.empty(0)
+        self.lower, self.upper = None, None
+        self.count = 0
+
+    @property
+    def edges(self):
+        return np.linspace(self.lower, self.upper, self.num_bins+1)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        if self.lower is None:
+            q_lower, q_upper = np.percentile(values, [100 * self.tail_fraction, 100 * (1 - self.tail_fraction)])
+            padding = (q_upper - q_lower) / 2
+            self.lower, self.upper = q_lower - padding, q_upper + padding
+            if self.lower == self.upper:
+                padding = 1e-6 * abs(self.lower) if self.lower != 0 else 0.5
+                self.lower, self.upper = self.lower - padding, self.upper + padding
+        self.count += len(values)
+        self.below = np.concatenate([self.below, values[values < self.lower]])
+        self.above = np.concatenate([self.above, values[values > self.upper]])
+        self.add_to_bins(values[np.logical_and(values >= self.lower, values <= self.upper)])
+        while len(self.below) > self.tail_fraction * self.count:
+            self.expand(left=True)
+        while len(self.above) > self.tail_fraction * self.count:
+            self.expand(left=False)
+
+    def add_to_bins(self, values):
+        width = (self.upper - self.lower) / self.num_bins
+        bins = np.clip(((values - self.lower) / width).astype(int), 0, self.num_bins-1)
+        self.counts += np.bincount(bins, minlength=self.num_bins)
+
+    def expand(self, left):
+        """Double the range by merging pairs of neighbouring bins, tail values that fall into the range are binned."""
+        merged = self.counts.reshape(-1, 2).sum(axis=1)
+        half = self.num_bins // 2
+        self.counts = np.zeros(self.num_bins, dtype=np.int64)
+        width = self.upper - self.lower
+        if left:
+            self.counts[half:] = merged
+            self.lower -= width
+            inside = self.below >= self.lower
+            self.add_to_bins(self.below[inside])
+            self.below = self.below[~inside]
+        else:
+            self.counts[:half] = merged
+            self.upper += width
+            inside = self.above <= self.upper
+            self.add_to_bins(self.above[inside])
+            self.above = self.above[~inside]
+
+    def quantile(self, q):
+        """Quantile for q in [0, 1], exact in the tails and linearly interpolated within a bin otherwise."""
+        cumulative = np.cumsum(self.counts)
+        target = q * self.count
+        rank = max(int(np.ceil(target)) - 1, 0)
+        if target <= len(self.below) and len(self.below) > 0:
+            return np.sort(self.below)[rank]
+        if target > len(self.below) + cumulative[-1] and len(self.above) > 0:
+            return np.sort(self.above)[min(rank - len(self.below) - cumulative[-1], len(self.above)-1)]
+        target -= len(self.below)
+        i = int(np.searchsorted(cumulative, target))
+        i = min(i, self.num_bins-1)
+        previous = cumulative[i-1] if i > 0 else 0
+        fraction = (target - previous) / self.counts[i] if self.counts[i] > 0 else 0
+        edges = self.edges
+        return edges[i] + fraction * (edges[i+1] - edges[i])
+
+    def histogram(self, lower_percentile=2.5, upper_percentile=97.5, num_bins=60):
+        """Coarse histogram between two percentiles, rebinned from the fine bins."""
+        lower, upper = self.quantile(lower_percentile / 100), self.quantile(upper_percentile / 100)
+        edges = self.edges
+        centers = (edges[:-1] + edges[1:]) / 2
+        mask = np.logical_and(centers > lower, centers < upper)
+        bins = np.linspace(lower, upper, num_bins, endpoint=True)
+        freq, bins = np.histogram(centers[mask], bins=bins, weights=self.counts[mask])
+        return freq, bins
+
+
+class IncrementalYReader:
+    """Reads new Y chunk files only, and keeps a streaming histogram of all MC scores read so far.
+
+    State is rebuilt from the chunk files, so that any process can serve a run. Threads of one process share the reader
+    and update it under `lock`.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.n_files = 0
+        self.last_mtime = None
+        self.histogram = StreamingHistogram()
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    def update(self):
+        with self.lock:
+            return self.update_files()
+
+    def update_files(self):
+        # Last chunk of a run that was stopped by a time budget is written again in full when the run is resumed
+        if self.n_files > 0:
+            fp_last = self.directory / f"Y{self.n_files-1:03d}.json"
+            if (not fp_last.exists()) or fp_last.stat().st_mtime_ns != self.last_mtime:
+                self.reset()
+        while True:
+            fp = self.directory / f"Y{self.n_files:03d}.json"
+            if not fp.exists():
+                break
+            try:
+                mtime = fp.stat().st_mtime_ns
+                Y_data = read_json(fp)
+            except json.JSONDecodeError:
+                # Chunk is still being written, try again at the next poll
+                break
+            self.histogram.update(Y_data)
+            self.n_files += 1
+            self.last_mtime = mtime
+        return self.n_files
+
+
+Y_READERS_SIZE = 8  # runs whose readers are kept, least recently used readers are dropped
+_Y_READERS = OrderedDict()
+_Y_READERS_LOCK = threading.Lock()
+
+
+def get_Y_reader(directory):
+    directory = str(directory)
+    with _Y_READERS_LOCK:
+        reader = _Y_READERS.get(directory)
+        if reader is None:
+            reader = _Y_READERS[directory] = IncrementalYReader(directory)
+            if len(_Y_READERS) > Y_READERS_SIZE:
+                _Y_READERS.popitem(last=False)
+        else:
+            _Y_READERS.move_to_end(directory)
+    return reader
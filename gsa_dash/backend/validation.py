@@ -1,19 +1,38 @@
 import numpy as np
-import bw_processing as bwp
-import bw2data as bd
-import bw2calc as bc
+import time
 from pathlib import Path
-from scipy.stats import spearmanr
+from functools import lru_cache
 
 # Local files
-from .data import collect_XY, write_json, collect_Y_validation, read_pickle
-from .life_cycle_assessment import get_bw_activity_and_method
+from .data import collect_XY, collect_run_Y, read_json, write_json, collect_Y_validation, read_pickle, is_cancelled
+from .life_cycle_assessment import get_bw_activity_and_method, get_database_versions
+from .low_rank_lca import LowRankLCA
+from .events import publish_event
+from .metrics import span, track_run, clear_run_timings, Throughput
+from .projects import set_current_project
+from .x_store import has_X_store, read_X_columns
 
 BIOSPHERE_TYPES = ['economic', 'emission', 'inventory indicator', 'natural resource', 'social']
+VALIDATION_SOLVER = "low_rank"  # "low_rank" or "lca"
 
 
-def run_validation(val_directory, S, val_config, lca_config):
+class ValidationCancelled(Exception):
+    pass
+
+
+class ValidationOutOfTime(Exception):
+    pass
+
+
+def run_validation(val_directory, S, val_config, lca_config, set_progress=None):
+    """Run validation simulations for the sizes of influential sets, skipping sizes that were already computed.
+
+    Returns False if the run was cancelled with a cancel token in `val_directory`. `set_progress` is called with the
+    number of computed sizes, the expected total number of sizes and the estimated seconds left. With `val_time_budget`
+    in minutes, no size is started that would not finish before the deadline at the measured time per size.
+    """
     val_directory = Path(val_directory)
+    clear_run_timings(val_directory)
     S = np.array(S)
     descending_argsort = np.argsort(S)[-1::-1]
 
@@ -23,18 +42,137 @@ def run_validation(val_directory, S, val_config, lca_config):
     project, database, activity, amount, method = lca_config["project"], lca_config["database"], \
                                                   lca_config["activity"], lca_config["amount"], lca_config["method"]
     bw_activity, method = get_bw_activity_and_method(project, database, activity, method)
-    bd.projects.set_current(project)
 
-    for current_inf in range(min_inf, max_inf+step_inf, step_inf):
+    low_rank_lca = None
+    if val_config.get("val_solver", VALIDATION_SOLVER) == "low_rank":
+        with track_run(val_directory), span("low_rank_factorization"):
+            low_rank_lca = LowRankLCA(bw_activity, amount, get_dps_without_uncertainty(method))
+
+    adaptive = val_config.get("val_mode") == "adaptive"
+    if adaptive:
+        max_inf = min(max_inf, len(S))
+        # Galloping and bisection each take at most log2 of the range of sizes
+        total_sizes = 2 * int(np.ceil(np.log2(max(max_inf - min_inf + 2, 1)))) + 1
+    else:
+        total_sizes = len(range(min_inf, max_inf+step_inf, step_inf))
+    sizes_done = []
+    time_budget = val_config.get("val_time_budget")
+    throughput = Throughput(time_budget * 60 if time_budget else None)
+
+    def cancelled():
+        return is_cancelled(val_directory)
+
+    def run_validation_size(current_inf):
+        if cancelled():
+            raise ValidationCancelled
         fp_inf = val_directory / f"Yinf{current_inf:04d}.json"
-        if not fp_inf.exists():
+        if fp_inf.exists():
+            Yinf = read_json(fp_inf)
+        else:
+            if throughput.get_items_fit(1) == 0:
+                raise ValidationOutOfTime
+            start = time.perf_counter()
             mask_inf = descending_argsort[:current_inf]
-            Yinf = run_validation_step(val_directory, mask_inf, iterations, bw_activity, amount, method)
+            if low_rank_lca is not None:
+                Yinf = run_validation_step_low_rank(val_directory, mask_inf, iterations, low_rank_lca)
+            else:
+                Yinf = run_validation_step(
+                    val_directory, mask_inf, iterations, bw_activity, amount, method, cancelled
+                )
             write_json(Yinf, fp_inf)
-    return
+            throughput.record(time.perf_counter() - start, 1)
+        sizes_done.append(current_inf)
+        eta = throughput.get_eta(max(total_sizes - len(sizes_done), 0))
+        publish_event(val_directory, {
+            "type": "validation", "influential": current_inf, "sizes": len(sizes_done), "eta": eta,
+        })
+        if set_progress is not None:
+            set_progress(min(len(sizes_done), total_sizes), total_sizes, eta)
+        return Yinf
+
+    finished = {"type": "finished"}
+    try:
+        with track_run(val_directory):
+            if adaptive:
+                Yall = collect_run_Y(val_directory.parent)[:iterations]
+                target = val_config["val_target"]
+                influential = search_influential(run_validation_size, Yall, min_inf, max_inf, target)
+                finished.update(influential=influential, target=target, max_inf=max_inf)
+            else:
+                for current_inf in range(min_inf, max_inf+step_inf, step_inf):
+                    run_validation_size(current_inf)
+    except ValidationCancelled:
+        publish_event(val_directory, {"type": "cancelled"})
+        return False
+    except ValidationOutOfTime:
+        publish_event(val_directory, {"type": "finished", "reason": "time", "sizes": len(sizes_done)})
+        return True
+    publish_event(val_directory, finished)
+    return True
+
+
+def run_validation_size_task(val_directory, mask_inf, val_config, lca_config):
+    """Validation simulations for one influential set, run as a work queue task."""
+    val_directory = Path(val_directory)
+    project, database, activity, amount, method = lca_config["project"], lca_config["database"], \
+                                                  lca_config["activity"], lca_config["amount"], lca_config["method"]
+    bw_activity, method = get_bw_activity_and_method(project, database, activity, method)
+    mask_inf, iterations = np.array(mask_inf, dtype=int), val_config["val_iterations"]
+    with track_run(val_directory):
+        if val_config.get("val_solver", VALIDATION_SOLVER) == "low_rank":
+            with span("low_rank_factorization"):
+                low_rank_lca = get_low_rank_lca(project, bw_activity.id, amount, method, get_database_versions())
+            Yinf = run_validation_step_low_rank(val_directory, mask_inf, iterations, low_rank_lca)
+        else:
+            Yinf = run_validation_step(val_directory, mask_inf, iterations, bw_activity, amount, method)
+    write_json(Yinf, val_directory / f"Yinf{len(mask_inf):04d}.json")
+
+
+@lru_cache(maxsize=4)
+def get_low_rank_lca(project, activity_id, amount, method, database_versions):
+    """Factorized LCA is reused by all tasks of a worker for the same LCA study.
+
+    `database_versions` is part of the cache key, so that a database modified since the factorization is factorized
+    again.
+    """
+    import bw2data as bd
+    set_current_project(project)
+    return LowRankLCA(bd.get_activity(activity_id), amount, get_dps_without_uncertainty(method))
+
+
+def search_influential(run_validation_size, Yall, min_inf, max_inf, target):
+    """Find the smallest number of influential inputs whose Spearman correlation with Yall reaches the target.
+
+    Sizes are first doubled (galloping) until the target is met, and then bisected between the last failing and the
+    first passing size. Returns None if the target is not met even with `max_inf` inputs, or if `min_inf` exceeds
+    `max_inf`.
+    """
+    from scipy.stats import spearmanr
+
+    def correlation(current_inf):
+        Yinf = run_validation_size(current_inf)
+        r = spearmanr(Yall, Yinf).correlation
+        return 0 if np.isnan(r) else r
+
+    if min_inf > max_inf:
+        return None
+    lower, upper = min_inf - 1, min_inf
+    while correlation(upper) < target:
+        if upper == max_inf:
+            return None
+        # Size 0 is followed by 1, since doubling it stays at 0
+        lower, upper = upper, min(upper + max(upper, 1), max_inf)
+    while upper - lower > 1:
+        middle = (lower + upper) // 2
+        if correlation(middle) < target:
+            lower = middle
+        else:
+            upper = middle
+    return upper
 
 
 def collect_validation_results(directory):
+    from scipy.stats import spearmanr
     directory = Path(directory)
     Y = collect_Y_validation(directory)
     Yall = Y.pop("all")
@@ -45,29 +183,88 @@ def collect_validation_results(directory):
     return metric
 
 
-def run_validation_step(val_directory, mask_inf, iterations, bw_activity, amount, method):
-    directory = val_directory.parent
+def predict_validation_surrogate(X, Y, S, min_inf, max_inf, model="linear", n_bootstrap=20, seed=None):
+    """Preview validation curve with a surrogate model fitted on existing MC inputs X and scores Y.
+
+    Non-influential inputs are fixed to their median values, which approximates the prescribed values of lognormally
+    distributed exchanges. Error estimates are standard deviations of the correlations over bootstrapped surrogates.
+    """
+    from scipy.stats import spearmanr
+    X, Y = np.array(X), np.array(Y)
+    descending_argsort = np.argsort(np.array(S))[-1::-1]
+    X_fixed = np.median(X, axis=0)
+    max_inf = min(max_inf, X.shape[1])
+    influential_range = range(min_inf, max_inf+1)
+    rng = np.random.default_rng(seed)
+    correlations = np.zeros((n_bootstrap, len(influential_range)))
+    for b in range(n_bootstrap):
+        sample = rng.integers(0, len(Y), len(Y))
+        surrogate = create_surrogate(model).fit(X[sample], Y[sample])
+        for j, current_inf in enumerate(influential_range):
+            Xinf = np.tile(X_fixed, (len(Y), 1))
+            mask_inf = descending_argsort[:current_inf]
+            Xinf[:, mask_inf] = X[:, mask_inf]
+            r = spearmanr(Y, surrogate.predict(Xinf)).correlation
+            correlations[b, j] = 0 if np.isnan(r) else r
+    metric = dict(zip(influential_range, np.mean(correlations, axis=0).tolist()))
+    error = dict(zip(influential_range, np.std(correlations, axis=0).tolist()))
+    return metric, error
+
+
+def create_surrogate(model):
+    if model == "linear":
+        from sklearn.linear_model import LinearRegression
+        return LinearRegression()
+    elif model == "gradient_boosting":
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        return HistGradientBoostingRegressor(max_iter=100)
+    else:
+        raise ValueError(f"Unknown surrogate model: {model}")
+
+
+def get_dps_without_uncertainty(method):
+    import bw2data as bd
     me = bd.Method(method).datapackage()  # TODO Method can also have uncertainty!
     dps_no_unct = [me]
     for database in bd.databases:
         dp = bd.Database(database).datapackage()
         dp = dp.exclude({"kind": "distributions"})
         dps_no_unct.append(dp)
+    return dps_no_unct
 
-    influential = len(mask_inf)
-    name = f"validation_inf{influential}"
-    dps_inf = bwp.create_datapackage(
-        name=name,
-        sequential=True,
-    )
-    Xall, _ = collect_XY(directory)
-    Xinf = Xall[:iterations, :][:, mask_inf]
+
+def get_influential_inputs(directory, mask_inf, iterations):
+    import bw2data as bd
+    with span("collect_XY"):
+        if has_X_store(directory):
+            # Only columns of influential inputs are read from the column store
+            Xinf = read_X_columns(directory, mask_inf, iterations)
+        else:
+            Xall, _ = collect_XY(directory)
+            Xinf = Xall[:iterations, :][:, mask_inf]
     indices = read_pickle(directory / "indices.pickle")
     indices_inf = indices[mask_inf]
     mask_bio = np.zeros(len(indices_inf), dtype=bool)
     for i, index in enumerate(indices_inf):
         if bd.get_activity(index[0]).get("type") in BIOSPHERE_TYPES:
             mask_bio[i] = 1
+    return Xinf, indices_inf, mask_bio
+
+
+def run_validation_step(val_directory, mask_inf, iterations, bw_activity, amount, method, cancelled=None):
+    import bw2calc as bc
+    import bw_processing as bwp
+    directory = val_directory.parent
+    with span("datapackages"):
+        dps_no_unct = get_dps_without_uncertainty(method)
+
+    influential = len(mask_inf)
+    name = f"validation_inf{influential}"
+    dps_inf = bwp.create_datapackage(
+        name=name,
+        sequential=True,
+    )
+    Xinf, indices_inf, mask_bio = get_influential_inputs(directory, mask_inf, iterations)
     dps_inf.add_persistent_array(
         matrix=f"technosphere_matrix",
         data_array=Xinf[:, ~mask_bio].T,
@@ -88,11 +285,27 @@ def run_validation_step(val_directory, mask_inf, iterations, bw_activity, amount
         use_distributions=False,
         use_arrays=True,
     )
-    lca.lci()
-    lca.lcia()
+    with span("lci"):
+        lca.lci()
+        lca.lcia()
     lca.keep_first_iteration()
     scores_inf = []
-    for i in range(iterations):
-        next(lca)
-        scores_inf.append(lca.score)
+    with span("validation_solve") as solve_span:
+        for i in range(iterations):
+            if (cancelled is not None) and cancelled():
+                raise ValidationCancelled
+            next(lca)
+            scores_inf.append(lca.score)
+            solve_span.items = len(scores_inf)
     return scores_inf
+
+
+def run_validation_step_low_rank(val_directory, mask_inf, iterations, low_rank_lca):
+    """Same as `run_validation_step`, but rescores the factorized deterministic LCA for all iterations at once."""
+    directory = val_directory.parent
+    Xinf, indices_inf, mask_bio = get_influential_inputs(directory, mask_inf, iterations)
+    with span("validation_solve", items=iterations):
+        scores_inf = low_rank_lca.compute_scores(
+            indices_inf[~mask_bio], Xinf[:, ~mask_bio], indices_inf[mask_bio], Xinf[:, mask_bio],
+        )
+    return scores_inf.tolist()
@@ -0,0 +1,314 @@
+import json
+import numpy as np
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+# Local files
+from .convergence import ConvergenceMonitor, write_convergence_report, clear_convergence_report
+from .data import read_json, write_json, write_pickle, read_pickle, is_cancelled
+from .events import publish_event
+from .metrics import span, track_run, clear_run_timings, Throughput
+from .life_cycle_assessment import get_pruning
+from .monte_carlo import get_chunks, get_chunk_design, run_simulations_from_X_chunk, PRUNING_FILE
+from .x_store import get_X_chunk_file, write_X_chunk, read_X_chunk
+from .validation import run_validation_size_task
+
+CHUNKS_DIRECTORY = "chunks"
+TASK_LEASE = 3600  # seconds, after which a task claimed by a silent worker is handed out again
+
+
+class SQLiteBroker:
+    """Work queue in an SQLite file, e.g. on the cache volume shared by the worker hosts.
+
+    Any broker with the same `submit`, `claim`, `complete`, `fail`, `cancel` and `count` methods can replace it.
+    """
+
+    def __init__(self, fp):
+        self.fp = str(fp)
+        Path(self.fp).parent.mkdir(parents=True, exist_ok=True)
+        self.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT UNIQUE,
+                    kind TEXT,
+                    payload TEXT,
+                    status TEXT DEFAULT 'queued',
+                    worker TEXT,
+                    claimed_at REAL,
+                    error TEXT
+                )
+            """)
+
+    def connect(self):
+        return sqlite3.connect(self.fp, timeout=60, isolation_level=None)
+
+    def execute(self, sql, parameters=()):
+        con = self.connect()
+        try:
+            return con.execute(sql, parameters).fetchall()
+        finally:
+            con.close()
+
+    def submit(self, key, kind, payload):
+        """Add task unless a task with the same key is queued or running, finished tasks are queued again."""
+        self.execute(
+            "INSERT INTO tasks (key, kind, payload) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET status='queued', payload=excluded.payload, error=NULL "
+            "WHERE status IN ('failed', 'done')",
+            (key, kind, json.dumps(payload)),
+        )
+
+    def claim(self, worker, key_prefix=""):
+        """Oldest task that is queued or whose lease expired, only tasks with keys that start with `key_prefix`."""
+        con = self.connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute(
+                "SELECT id, kind, payload FROM tasks WHERE substr(key, 1, ?) = ? "
+                "AND (status='queued' OR (status='running' AND claimed_at < ?)) ORDER BY id LIMIT 1",
+                (len(key_prefix), key_prefix, time.time() - TASK_LEASE),
+            ).fetchone()
+            if row is not None:
+                con.execute(
+                    "UPDATE tasks SET status='running', worker=?, claimed_at=? WHERE id=?",
+                    (worker, time.time(), row[0]),
+                )
+            con.execute("COMMIT")
+        finally:
+            con.close()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, task_id):
+        self.execute("UPDATE tasks SET status='done' WHERE id=?", (task_id,))
+
+    def fail(self, task_id, error):
+        self.execute("UPDATE tasks SET status='failed', error=? WHERE id=?", (error, task_id))
+
+    def cancel(self, key_prefix):
+        """Remove queued tasks, so that workers do not compute tasks of a run that ended, was cancelled or failed."""
+        self.execute(
+            "DELETE FROM tasks WHERE substr(key, 1, ?) = ? AND status='queued'", (len(key_prefix), key_prefix),
+        )
+
+    def count(self, key_prefix, status):
+        return self.execute(
+            "SELECT COUNT(*) FROM tasks WHERE substr(key, 1, ?) = ? AND status=?",
+            (len(key_prefix), key_prefix, status),
+        )[0][0]
+
+
+def get_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_task(kind, payload):
+    if kind == "mc_chunk":
+        run_simulations_chunk_task(**payload)
+    elif kind == "validation_size":
+        run_validation_size_task(**payload)
+    else:
+        raise ValueError(f"Unknown task kind: {kind}")
+
+
+def work(broker, max_tasks=None, poll_time=1, idle_timeout=None, key_prefix=""):
+    """Worker loop, claims and runs tasks until `max_tasks` were run or the queue was idle for `idle_timeout` s.
+
+    With `key_prefix`, e.g. of the tasks of one run, only those tasks are claimed.
+    """
+    worker = get_worker_name()
+    tasks_done, idle_since = 0, time.time()
+    while (max_tasks is None) or (tasks_done < max_tasks):
+        task = broker.claim(worker, key_prefix)
+        if task is None:
+            if (idle_timeout is not None) and (time.time() - idle_since > idle_timeout):
+                break
+            time.sleep(poll_time)
+            continue
+        task_id, kind, payload = task
+        try:
+            run_task(kind, payload)
+            broker.complete(task_id)
+        except Exception as e:
+            broker.fail(task_id, repr(e))
+        tasks_done += 1
+        idle_since = time.time()
+    return tasks_done
+
+
+def run_simulations_chunk_task(directory, lca_mc_config, chunk, iterations_chunk, seed):
+    """Compute one MC chunk and stage its outputs for `aggregate_simulations`."""
+    chunks_directory = Path(directory) / CHUNKS_DIRECTORY
+    background = lca_mc_config.get("uncertainty", "foreground") == "all"
+    prune = lca_mc_config.get("prune", True)
+    # Pruning of the run, so that chunks of all workers have the same inputs
+    pruning = read_pickle(Path(directory) / PRUNING_FILE) if prune else None
+    with track_run(directory):
+        results = run_simulations_from_X_chunk(
+            lca_mc_config["project"], lca_mc_config["database"], lca_mc_config["activity"], lca_mc_config["amount"],
+            lca_mc_config["method"], iterations_chunk, seed, sampling=lca_mc_config.get("sampling", "random"),
+            prune=prune, background=background, pruning=pruning, **get_chunk_design(lca_mc_config, chunk),
+        )
+        input_indices, input_data, mc_scores = results
+        with span("write_chunk"):
+            if background:
+                write_X_chunk(input_data, get_X_chunk_file(chunks_directory, chunk, store=True))
+            else:
+                write_json(input_data, get_X_chunk_file(chunks_directory, chunk, store=False))
+            write_pickle(input_indices, chunks_directory / f"indices{chunk:03d}.pickle")
+            write_json(mc_scores, chunks_directory / f"Y{chunk:03d}.json")
+
+
+def aggregate_simulations(directory, chunks):
+    """Move staged chunk outputs into the run directory in chunk order, returns number of published iterations.
+
+    Chunks are published in order, so that readers of the run directory never see gaps.
+    """
+    directory = Path(directory)
+    chunks_directory = directory / CHUNKS_DIRECTORY
+    fpI = directory / "indices.pickle"
+    iterations_done = 0
+    for i, iterations_chunk, _ in chunks:
+        fpY = directory / f"Y{i:03d}.json"
+        if not fpY.exists():
+            staged_Y = chunks_directory / f"Y{i:03d}.json"
+            if not staged_Y.exists():
+                break
+            if not fpI.exists():
+                write_pickle(read_pickle(chunks_directory / f"indices{i:03d}.pickle"), fpI)
+            for store in [False, True]:
+                staged_X = get_X_chunk_file(chunks_directory, i, store)
+                if staged_X.exists():
+                    os.replace(staged_X, get_X_chunk_file(directory, i, store))
+            os.replace(staged_Y, fpY)
+            iterations_done += iterations_chunk
+            publish_event(directory, {"type": "chunk", "chunk": i, "iterations": iterations_done})
+        else:
+            iterations_done += iterations_chunk
+    return iterations_done
+
+
+def run_simulations_distributed(directory, lca_mc_config, broker, set_progress=None, poll_time=1):
+    """Same as `run_simulations_from_X_all`, but every chunk is a task in the work queue.
+
+    The calling process works on the queue too, so that runs finish without separate workers.
+    """
+    directory = Path(directory)
+    (directory / CHUNKS_DIRECTORY).mkdir(exist_ok=True)
+    clear_run_timings(directory)
+    if lca_mc_config.get("prune", True):
+        with track_run(directory):
+            pruning = get_pruning(
+                lca_mc_config["project"], lca_mc_config["database"], lca_mc_config["activity"], lca_mc_config["method"]
+            )
+        write_pickle(pruning, directory / PRUNING_FILE)
+    iterations = lca_mc_config["iterations"]
+    chunks = get_chunks(iterations, lca_mc_config["iterations_chunk"], lca_mc_config["seed"])
+    for i, iterations_chunk, seed in chunks:
+        published = (directory / f"Y{i:03d}.json").exists()
+        staged = (directory / CHUNKS_DIRECTORY / f"Y{i:03d}.json").exists()
+        if not (published or staged):
+            payload = dict(
+                directory=str(directory), lca_mc_config=lca_mc_config, chunk=i, iterations_chunk=iterations_chunk,
+                seed=seed,
+            )
+            broker.submit(f"{directory}/Y{i:03d}", "mc_chunk", payload)
+    background = lca_mc_config.get("uncertainty", "foreground") == "all"
+    monitor = ConvergenceMonitor(keep_X=not background) if lca_mc_config.get("stopping") == "converged" else None
+    time_budget = lca_mc_config.get("time_budget")
+    # Wall clock throughput of all workers together
+    throughput = Throughput(time_budget * 60 if time_budget else None)
+    clear_convergence_report(directory)
+    chunks_checked, iterations_previous, time_previous = 0, None, time.perf_counter()
+    prefix = f"{directory}/Y"
+    try:
+        while True:
+            iterations_done = aggregate_simulations(directory, chunks)
+            if iterations_previous is not None:
+                throughput.record(time.perf_counter() - time_previous, iterations_done - iterations_previous)
+            iterations_previous, time_previous = iterations_done, time.perf_counter()
+            if set_progress is not None:
+                set_progress(iterations_done, throughput.get_eta(iterations - iterations_done))
+            reason = None
+            if monitor is not None:
+                # Published chunks are checked in order, every chunk once
+                while (chunks_checked < len(chunks)) and (monitor.iterations < iterations_done) and (reason is None):
+                    i = chunks[chunks_checked][0]
+                    with span("convergence"):
+                        X_chunk = read_X_chunk(get_X_chunk_file(directory, i, store=background))
+                        Y_chunk = read_json(directory / f"Y{i:03d}.json")
+                        if monitor.update(X_chunk, Y_chunk):
+                            reason = "converged"
+                    chunks_checked += 1
+            if (reason is None) and (iterations_done == iterations):
+                reason = "budget"
+            elif (reason is None) and throughput.is_over():
+                reason = "time"
+            if reason is not None:
+                if (monitor is None) and (throughput.deadline is None):
+                    publish_event(directory, {"type": "finished"})
+                    return True
+                if monitor is not None:
+                    report = monitor.get_report(reason)
+                else:
+                    report = dict(reason=reason, iterations=iterations_done)
+                write_convergence_report(directory, report)
+                publish_event(directory, {"type": "finished", "reason": reason, "iterations": report["iterations"]})
+                return True
+            if is_cancelled(directory):
+                publish_event(directory, {"type": "cancelled"})
+                return False
+            if broker.count(prefix, "failed") > 0:
+                raise RuntimeError(f"MC chunk tasks failed for {directory}")
+            # Only chunks of this run, so that cancellation and deadline are checked after every chunk
+            if work(broker, max_tasks=1, poll_time=0, idle_timeout=0, key_prefix=prefix) == 0:
+                time.sleep(poll_time)
+    finally:
+        broker.cancel(prefix)
+
+
+def run_validation_distributed(val_directory, S, val_config, lca_config, broker, set_progress=None, poll_time=1):
+    """Grid validation where every size of the influential set is a task in the work queue."""
+    val_directory = Path(val_directory)
+    clear_run_timings(val_directory)
+    descending_argsort = np.argsort(np.array(S))[-1::-1].tolist()
+    min_inf, max_inf, step_inf = val_config["val_min"], val_config["val_max"], val_config["val_step"]
+    sizes = list(range(min_inf, max_inf+step_inf, step_inf))
+    for current_inf in sizes:
+        if not (val_directory / f"Yinf{current_inf:04d}.json").exists():
+            payload = dict(
+                val_directory=str(val_directory), mask_inf=descending_argsort[:current_inf], val_config=val_config,
+                lca_config=lca_config,
+            )
+            broker.submit(f"{val_directory}/Yinf{current_inf:04d}", "validation_size", payload)
+    time_budget = val_config.get("val_time_budget")
+    throughput = Throughput(time_budget * 60 if time_budget else None)
+    sizes_previous, time_previous = None, time.perf_counter()
+    prefix = f"{val_directory}/Yinf"
+    try:
+        while True:
+            sizes_done = sum((val_directory / f"Yinf{current_inf:04d}.json").exists() for current_inf in sizes)
+            if sizes_previous is not None:
+                throughput.record(time.perf_counter() - time_previous, sizes_done - sizes_previous)
+            sizes_previous, time_previous = sizes_done, time.perf_counter()
+            if set_progress is not None:
+                set_progress(sizes_done, len(sizes), throughput.get_eta(len(sizes) - sizes_done))
+            if sizes_done == len(sizes):
+                publish_event(val_directory, {"type": "finished"})
+                return True
+            if throughput.is_over():
+                publish_event(val_directory, {"type": "finished", "reason": "time", "sizes": sizes_done})
+                return True
+            if is_cancelled(val_directory):
+                publish_event(val_directory, {"type": "cancelled"})
+                return False
+            if broker.count(prefix, "failed") > 0:
+                raise RuntimeError(f"Validation tasks failed for {val_directory}")
+            if work(broker, max_tasks=1, poll_time=0, idle_timeout=0, key_prefix=prefix) == 0:
+                time.sleep(poll_time)
+    finally:
+        broker.cancel(prefix)
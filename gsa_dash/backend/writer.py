@@ -0,0 +1,72 @@
+import queue
+import threading
+import time
+from contextvars import copy_context
+
+WRITER_QUEUE_SIZE = 2  # chunks that wait to be written, each holds its X in memory
+
+
+class ChunkWriter:
+    """Writes chunks in a background thread, so that the next chunk is computed while the previous one is written.
+
+    Jobs run in the order they are submitted, so that Y files are published in chunk order. When `queue_size` jobs
+    are waiting, `submit` blocks until the writer catches up, this backpressure is measured in `blocked_seconds`. A
+    job that fails is raised by the next `submit` or by `close`, and jobs after it are skipped, so that no chunk is
+    published after a missing one. Use as a context manager, pending jobs are written when the block is left.
+    """
+
+    def __init__(self, queue_size=WRITER_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.blocked_seconds = 0.0
+        # Spans of the writer are added to the timings of the run tracked by the submitting thread
+        self.thread = threading.Thread(target=copy_context().run, args=(self.run,), daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    job()
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    @property
+    def pending(self):
+        """Jobs that are queued or being written."""
+        return self.queue.unfinished_tasks
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, job):
+        """Queue `job`, returns the seconds it waited for a free place in the queue."""
+        self.raise_error()
+        start = time.perf_counter()
+        self.queue.put(job)
+        blocked = time.perf_counter() - start
+        self.blocked_seconds += blocked
+        return blocked
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # The error of the block takes precedence over an error of the writer
+            self.queue.put(None)
+            self.thread.join()
+        return False
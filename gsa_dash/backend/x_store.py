@@ -0,0 +1,70 @@
+import numpy as np
+import os
+from pathlib import Path
+
+# Local files
+from .data import write_atomic, close_atomic, read_json
+
+X_STORE_SUFFIX = ".npy"
+X_BLOCK_SIZE = 1024  # columns of X that out-of-core GSA holds in memory at once, for all iterations
+
+
+def write_X_chunk(X, fp):
+    """Chunk of X as float32 in column-major order, so that blocks of columns are contiguous on disk."""
+    h, fp = write_atomic(fp, 'wb')
+    try:
+        np.save(h, np.asfortranarray(X, dtype=np.float32))
+    except BaseException:
+        h.close()
+        os.remove(h.name)
+        raise
+    close_atomic(h, fp)
+
+
+def read_X_chunk(fp):
+    """X chunk from the column store or from JSON."""
+    fp = Path(fp)
+    if fp.suffix == X_STORE_SUFFIX:
+        return np.load(fp)
+    return read_json(fp)
+
+
+def get_X_chunk_file(directory, chunk, store):
+    return Path(directory) / f"X{chunk:03d}{X_STORE_SUFFIX if store else '.json'}"
+
+
+def has_X_store(directory):
+    return (Path(directory) / f"X000{X_STORE_SUFFIX}").exists()
+
+
+def open_X_store(directory, rows=None):
+    """Memory mapped X chunks of all published Y chunks in chunk order, limited to the first `rows` iterations."""
+    directory = Path(directory)
+    Y_files = sorted([f for f in directory.iterdir() if "Y" in f.name and "inf" not in f.name])
+    chunks, n_rows = [], 0
+    for Y_file in Y_files:
+        if (rows is not None) and n_rows >= rows:
+            break
+        chunk = np.load(directory / Y_file.name.replace("Y", "X").replace(".json", X_STORE_SUFFIX), mmap_mode="r")
+        if rows is not None:
+            chunk = chunk[:rows - n_rows]
+        chunks.append(chunk)
+        n_rows += chunk.shape[0]
+    return chunks
+
+
+def iter_X_blocks(directory, rows=None, block_size=X_BLOCK_SIZE):
+    """Blocks of columns of X for all iterations, as the first column and a float32 array of the block.
+
+    Only one block is in memory at a time, so that GSA of X that does not fit in memory runs block by block.
+    """
+    chunks = open_X_store(directory, rows)
+    n_inputs = chunks[0].shape[1]
+    for start in range(0, n_inputs, block_size):
+        yield start, np.vstack([chunk[:, start:start+block_size] for chunk in chunks])
+
+
+def read_X_columns(directory, columns, rows=None):
+    """Selected columns of X, e.g. influential inputs, for the first `rows` iterations."""
+    columns = np.asarray(columns, dtype=int)
+    return np.vstack([chunk[:, columns] for chunk in open_X_store(directory, rows)]).astype(float)
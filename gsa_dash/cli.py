@@ -0,0 +1,209 @@
+# Run the full MC -> GSA -> validation pipeline without the dashboard, e.g.
+# `python cli.py run jobs.yaml --max-workers 4`.
+# Results are written to the same cache as the dashboard, so finished runs can be opened there.
+import argparse
+import csv
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# Local files
+from backend.data import create_run_directory, create_validation_directory, clear_cancel
+from backend.jobs import run_single_flight
+from backend.work_queue import SQLiteBroker, run_simulations_distributed, run_validation_distributed, work
+from backend.life_cycle_assessment import get_bw_activity_and_method
+from backend.monte_carlo import run_simulations_from_X_all
+from backend.results import read_results
+from backend.validation import run_validation
+from pipeline import run_sensitivity_analysis
+from constants import (
+    ITERATIONS, SEED, SAMPLING, MC_STOPPING, TIME_BUDGET, MC_UNCERTAINTY, VALIDATION_MIN, VALIDATION_MAX,
+    VALIDATION_STEP, VALIDATION_ITERATIONS, VALIDATION_MODE, VALIDATION_TARGET, VALIDATION_TIME_BUDGET, WORK_QUEUE
+)
+
+JOB_DEFAULTS = dict(
+    amount=1,
+    iterations=ITERATIONS,
+    iterations_chunk=None,
+    seed=SEED,
+    sampling=SAMPLING,
+    stopping=MC_STOPPING,
+    time_budget=TIME_BUDGET,
+    prune=True,
+    uncertainty=MC_UNCERTAINTY,
+    validation=True,
+    val_min=VALIDATION_MIN,
+    val_max=VALIDATION_MAX,
+    val_step=VALIDATION_STEP,
+    val_iterations=VALIDATION_ITERATIONS,
+    val_mode=VALIDATION_MODE,
+    val_target=VALIDATION_TARGET,
+    val_time_budget=VALIDATION_TIME_BUDGET,
+)
+INTEGER_FIELDS = ["iterations", "iterations_chunk", "seed", "val_min", "val_max", "val_step", "val_iterations"]
+
+
+def read_jobs(fp):
+    """Read jobs from YAML (list of jobs, or `jobs` key with such list) or CSV file with one job per row."""
+    fp = Path(fp)
+    if fp.suffix in [".yaml", ".yml"]:
+        import yaml
+        with open(fp) as f:
+            data = yaml.safe_load(f)
+        jobs = data["jobs"] if isinstance(data, dict) else data
+    elif fp.suffix == ".csv":
+        with open(fp, newline="") as f:
+            jobs = [{k: v for k, v in row.items() if v not in ("", None)} for row in csv.DictReader(f)]
+    else:
+        raise ValueError(f"Unknown jobs file format: {fp.suffix}")
+    return [normalize_job(job) for job in jobs]
+
+
+def normalize_job(job):
+    job = {**JOB_DEFAULTS, **job}
+    for field in ["project", "database", "activity", "method"]:
+        if field not in job:
+            raise ValueError(f"Job is missing `{field}`: {job}")
+    for field in INTEGER_FIELDS:
+        if job[field] is not None:
+            job[field] = int(job[field])
+    if job["iterations_chunk"] is None:
+        job["iterations_chunk"] = max(job["iterations"] // 10, 1)
+    # Same amount representation as the dashboard input, since it is part of the cache directory name
+    amount = float(job["amount"])
+    job["amount"] = int(amount) if amount.is_integer() else amount
+    job["val_target"] = float(job["val_target"])
+    for field in ["time_budget", "val_time_budget"]:
+        if job[field] is not None:
+            job[field] = float(job[field])
+    if isinstance(job["activity"], str) and job["activity"].isdigit():
+        job["activity"] = int(job["activity"])
+    for field in ["validation", "prune"]:
+        if isinstance(job[field], str):
+            job[field] = job[field].lower() in ["1", "true", "yes"]
+    return job
+
+
+def run_job(job, work_queue=None):
+    """Run all stages of one job. Completed MC chunks, GSA and validation results are reused.
+
+    With `work_queue`, MC chunks and grid validation steps are tasks in the queue, shared with `worker` processes.
+    """
+    broker = SQLiteBroker(work_queue) if work_queue is not None else None
+    bw_activity, _ = get_bw_activity_and_method(job["project"], job["database"], job["activity"], job["method"])
+    # Dashboard identifies activities by ids
+    lca_config = dict(
+        project=job["project"], database=job["database"], activity=bw_activity.id, amount=job["amount"],
+        method=job["method"],
+    )
+    mc_config = dict(
+        iterations=job["iterations"], iterations_chunk=job["iterations_chunk"], seed=job["seed"],
+        sampling=job["sampling"], stopping=job["stopping"], time_budget=job["time_budget"], prune=job["prune"],
+        uncertainty=job["uncertainty"],
+    )
+    lca_mc_config = {**lca_config, **mc_config}
+    directory = create_run_directory(lca_mc_config)
+
+    def run_mc():
+        clear_cancel(directory)
+        if broker is not None:
+            return run_simulations_distributed(directory, lca_mc_config, broker)
+        return run_simulations_from_X_all(directory, lca_mc_config)
+
+    if not run_single_flight(directory, run_mc):
+        return directory, "cancelled"
+    if (read_results(directory) is not None) and not job["validation"]:
+        return directory, "finished"
+    _, sensitivity_indices, _ = run_sensitivity_analysis(directory, lca_config)
+    if job["validation"]:
+        val_config = {
+            k: job[k]
+            for k in ["val_min", "val_max", "val_step", "val_iterations", "val_mode", "val_target", "val_time_budget"]
+        }
+        val_directory = create_validation_directory(directory, job["val_iterations"])
+
+        def run_val():
+            clear_cancel(val_directory)
+            if (broker is not None) and val_config["val_mode"] != "adaptive":
+                return run_validation_distributed(val_directory, sensitivity_indices, val_config, lca_config, broker)
+            return run_validation(val_directory, sensitivity_indices, val_config, lca_config)
+
+        if not run_single_flight(val_directory, run_val):
+            return directory, "cancelled"
+    return directory, "finished"
+
+
+def run_jobs(jobs, max_workers=1, work_queue=None):
+    """Run jobs with at most `max_workers` processes, returns number of failed jobs."""
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, job, work_queue): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            job = jobs[i]
+            name = f"[{i+1}/{len(jobs)}] {job['activity']} ({job['project']}, {job['method']})"
+            try:
+                directory, status = future.result()
+                print(f"{name}: {status}, {directory}")
+            except Exception:
+                failed += 1
+                print(f"{name}: failed\n{traceback.format_exc()}", file=sys.stderr)
+    return failed
+
+
+def serve(bind, workers, threads):
+    """Serve the dashboard with gunicorn, in `workers` processes with `threads` threads each.
+
+    Run state lives in the cache and the browser only holds run directories, so any worker serves any callback.
+    Threads keep server-sent event streams from blocking a whole worker.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class DashboardApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", bind)
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+
+        def load(self):
+            # Every worker imports the app after the fork, with its own Brightway project and caches
+            from app import server
+            return server
+
+    DashboardApplication().run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="gsa-dash", description="GSA of LCA dashboard without the dashboard.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_run = subparsers.add_parser("run", help="Run MC, GSA and validation for a batch of jobs.")
+    parser_run.add_argument("jobs", help="YAML or CSV file with project, database, activity, amount, method, "
+                                         "iterations and seed of each job.")
+    parser_run.add_argument("--max-workers", type=int, default=1, help="Number of jobs running at the same time.")
+    parser_run.add_argument("--queue", default=WORK_QUEUE, help="SQLite work queue shared with workers.")
+    parser_worker = subparsers.add_parser("worker", help="Run MC chunks and validation steps from the work queue.")
+    parser_worker.add_argument("--queue", default=WORK_QUEUE, required=WORK_QUEUE is None,
+                               help="SQLite work queue, on a volume shared by all hosts.")
+    parser_worker.add_argument("--idle-timeout", type=float, default=None,
+                               help="Stop after the queue was empty for this many seconds.")
+    parser_serve = subparsers.add_parser("serve", help="Serve the dashboard with several worker processes.")
+    parser_serve.add_argument("--bind", default="0.0.0.0:8050", help="Address and port to listen on.")
+    parser_serve.add_argument("--workers", type=int, default=4, help="Number of worker processes.")
+    parser_serve.add_argument("--threads", type=int, default=8, help="Number of threads per worker process.")
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        jobs = read_jobs(args.jobs)
+        failed = run_jobs(jobs, args.max_workers, args.queue)
+        return 1 if failed else 0
+    if args.command == "worker":
+        work(SQLiteBroker(args.queue), idle_timeout=args.idle_timeout)
+        return 0
+    if args.command == "serve":
+        serve(args.bind, args.workers, args.threads)
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,26 @@
+import os
+
 ITERATIONS = 100
+SAMPLING = "random"  # "random", "sobol", "halton" or "lhs"
+MC_STOPPING = "iterations"  # "iterations", or "converged" where iterations are the maximum budget
+TIME_BUDGET = None  # minutes, MC simulations stop at this deadline if set
+MC_UNCERTAINTY = "foreground"  # "foreground", or "all" to include uncertainty of background databases
 SEED = 1234567
-INTERVAL_TIME = 2  # seconds
+EVENTS_POLL_TIME = 0.2  # seconds, how often the server checks for new progress events
+EVENTS_TIMEOUT = 15  # seconds, after which the browser reconnects to the progress events stream
 LINEARITY_THRESHOLD = 0.75
 PAGE_SIZE = 20
 GT_CUTOFF = 1e-5
 GT_MAXCALC = 1e8
+ACTIVITY_SEARCH_LIMIT = 50
 
 VALIDATION_MIN = 1
 VALIDATION_MAX = 15
 VALIDATION_STEP = 2
 VALIDATION_ITERATIONS = 20
+VALIDATION_MODE = "grid"
+VALIDATION_TARGET = 0.95
+VALIDATION_TIME_BUDGET = None  # minutes, no validation step is started that would end after this deadline if set
+SURROGATE_MODEL = "linear"  # "linear" or "gradient_boosting"
+# Path to the SQLite work queue shared by worker hosts, MC chunks and validation steps run locally if not set
+WORK_QUEUE = os.environ.get("GSA_DASH_WORK_QUEUE")
@@ -1,11 +1,15 @@
 import os
 from dash import dcc, html, DiskcacheManager, CeleryManager, dash_table
-import bw2data as bd
 import dash_bootstrap_components as dbc
-from make_figures import plot_mc_simulations, plot_model_linearity, create_table_gsa_ranking, plot_validation
+from dash_extensions import EventSource
+from backend.sampling import SAMPLING_DESIGNS
+from make_figures import (
+    plot_mc_simulations, plot_model_linearity, create_empty_table_gsa_ranking, plot_validation, plot_stage_timings
+)
 from constants import (
-    ITERATIONS, SEED, INTERVAL_TIME, LINEARITY_THRESHOLD, PAGE_SIZE,
-    VALIDATION_MIN, VALIDATION_MAX, VALIDATION_STEP, VALIDATION_ITERATIONS
+    ITERATIONS, SEED, SAMPLING, MC_STOPPING, TIME_BUDGET, MC_UNCERTAINTY, LINEARITY_THRESHOLD, PAGE_SIZE,
+    VALIDATION_MIN, VALIDATION_MAX, VALIDATION_STEP, VALIDATION_ITERATIONS, VALIDATION_MODE, VALIDATION_TARGET,
+    VALIDATION_TIME_BUDGET,
 )
 
 color_even = "rgb(222, 221, 232, 0.5)"
@@ -47,12 +51,12 @@ def get_header():
 
 
 def get_top_controls():
-    projects = [p.name for p in bd.projects]
     top_controls = html.Div([
         html.Div([
             html.Div([
                 html.Label("Project", className="label"),
-                dcc.Dropdown(projects, id="project"),
+                # Projects are listed by a callback when the page is loaded, not when the layout is built
+                dcc.Dropdown([], id="project"),
             ], className="control-project"),
             html.Div([
                 html.Label("Database", className="label"),
@@ -60,11 +64,11 @@ def get_top_controls():
             ], className="control-database"),
             html.Div([
                 html.Label("Activity", className="label"),
-                dcc.Dropdown([], id="activity"),
+                dcc.Dropdown([], id="activity", placeholder="Type to search..."),
             ], className="control-activity"),
             html.Div([
                 html.Label("Amount", className="label"),
-                dbc.Input(id="amount", value=1, type="number", min=0)
+                dbc.Input(id="amount", value=1, type="number", min=0, debounce=True)
             ], className="control-amount"),
             html.Div([
                 html.Label("Method", className="label"),
@@ -88,14 +92,19 @@ def get_tabs():
     tab2_content = get_tab_uncertainty_propagation()
     tab3_content = get_tab_sensitivity_analysis()
     tab4_content = get_tab_gsa_validation()
+    tab_activities_content = get_tab_activities_overview()
+    tab_diagnostics_content = get_tab_diagnostics()
     # tab5_content = get_tab_summary()
     tabs = dbc.Tabs(
         active_tab="tab-motivation",
         children=[
             dbc.Tab(tab1_content, className="tab-content", label="Motivation", tab_id="tab-motivation"),
+            dbc.Tab(tab_activities_content, className="tab-content", label="Activities overview",
+                    tab_id="tab-activities"),
             dbc.Tab(tab2_content, className="tab-content", label="Uncertainty propagation", tab_id="tab-propagation"),
             dbc.Tab(tab3_content, className="tab-content", label="Global sensitivity analysis"),
             dbc.Tab(tab4_content, className="tab-content", label="GSA validation"),
+            dbc.Tab(tab_diagnostics_content, className="tab-content", label="Diagnostics", tab_id="tab-diagnostics"),
             # dbc.Tab(tab5_content, className="tab-content", label="Summary"),
         ],
         className="tabs-container"
@@ -234,6 +243,49 @@ def get_tab_motivation():
     return tab
 
 
+def get_tab_activities_overview():
+    tab = html.Div([
+        html.H2("Activities overview"),
+        dcc.Markdown(
+            '''
+            LCIA scores of one unit of every activity in the selected database for the selected method. All scores are 
+            computed at once with a single solve of the transposed LCA system, which helps to choose the activity to 
+            study and to see the magnitude of its impacts.
+            ''',
+            style={"marginBottom": "16px"}
+        ),
+        dash_table.DataTable(
+            data=[], columns=[{"name": i, "id": i} for i in ["Activity", "LCIA score"]], id="activities-table",
+            page_size=PAGE_SIZE, page_current=0, page_action='custom', sort_action='custom', sort_mode='multi',
+            filter_action='custom', filter_query='',
+            style_header={'backgroundColor': f'{color_light_purple}', 'textAlign': 'center',
+                          "font-family": "sans-serif", "font-size": "16px", "font-weight": 550, "color": "black"},
+            style_cell={"backgroundColor": color_none, 'textAlign': 'left'},
+            style_data_conditional=get_style_data_conditional(color_even),
+        ),
+    ], className="tab-activities")
+    return tab
+
+
+def get_tab_diagnostics():
+    tab = html.Div([
+        html.H2("Diagnostics"),
+        dcc.Markdown(
+            '''
+            Time spent in every stage of the current run, e.g. loading datapackages, sampling inputs, solving the LCA 
+            system for every iteration and writing results. Metrics of all runs are also available for monitoring 
+            tools at `/metrics`.
+            ''',
+            style={"marginBottom": "16px"}
+        ),
+        dbc.Button("Refresh", id="btn-refresh-diagnostics", n_clicks=0, outline=False, color="primary",
+                   className="btn-refresh-diagnostics"),
+        html.P(id="throughput", style={"marginTop": "16px"}),
+        dcc.Graph(id="timings-graph", figure=plot_stage_timings()),
+    ], className="tab-diagnostics")
+    return tab
+
+
 def get_tab_uncertainty_propagation():
     fig = plot_mc_simulations(iterations=ITERATIONS)
     mc_controls = get_mc_controls()
@@ -297,13 +349,38 @@ def get_mc_controls():
                 html.Label("Random seed", className="label"),
                 dbc.Input(id="seed", value=SEED, type="number")
             ], className="control-random-seed"),
+            html.Div([
+                html.Label("Sampling", className="label"),
+                dcc.Dropdown(
+                    [{"label": label, "value": value} for value, label in SAMPLING_DESIGNS.items()],
+                    value=SAMPLING, id="sampling", clearable=False,
+                )
+            ], className="control-sampling"),
+            html.Div([
+                html.Label("Stop", className="label"),
+                dcc.Dropdown(["iterations", "converged"], value=MC_STOPPING, id="stopping", clearable=False)
+            ], className="control-stopping"),
+            html.Div([
+                html.Label("Time budget, min", className="label"),
+                dbc.Input(id="time-budget", value=TIME_BUDGET, type="number", min=0)
+            ], className="control-time-budget"),
+            html.Div([
+                html.Label("Uncertainty", className="label"),
+                dcc.Dropdown(
+                    [{"label": "Foreground", "value": "foreground"}, {"label": "All databases", "value": "all"}],
+                    value=MC_UNCERTAINTY, id="uncertainty", clearable=False,
+                )
+            ], className="control-uncertainty"),
             dcc.Store(id="directory"),
             dcc.Store(id="mc-state", data=0),
             dcc.Store(id="mc-finished", data=False),
+            dcc.Store(id="mc-cancelled", data=False),
+            # Browser tab, only the tab that started a run cancels it for all tabs attached to it
+            dcc.Store(id="session", storage_type="session"),
             dbc.Button("Start", id="btn-start-mc", n_clicks=0, outline=False, color="primary",
                        className="btn-start-mc"),
             dbc.Button("Cancel", id="btn-cancel-mc", n_clicks=0, outline=False, color="warning",
-                       className="btn-cancel-mc"),
+                       className="btn-cancel-mc", disabled=True),
         ], className="mc-controls-container")
     ], className="mc-controls")
     return mc_controls
@@ -312,17 +389,17 @@ def get_mc_controls():
 def get_progress():
     progress = html.Div([
         html.Label("Progress:"),
-        dcc.Interval(id="mc-interval", n_intervals=0, interval=INTERVAL_TIME * 1000),
+        EventSource(id="mc-events"),
         dbc.Progress(id="mc-progress", className="mc-progress", value=0, label="0%"),
+        html.Div(id="mc-stopping", className="mc-stopping"),
     ], className="mc-progress-container")
     return progress
 
 
 def get_tab_sensitivity_analysis():
     fig_model_linearity = plot_model_linearity(linearity_threshold=LINEARITY_THRESHOLD, iterations_default=ITERATIONS)
-    df = create_table_gsa_ranking()
-    df_data = df.to_dict("records")
-    columns = [{"name": i, "id": i} for i in df.columns]
+    df_data, df_columns = create_empty_table_gsa_ranking()
+    columns = [{"name": i, "id": i} for i in df_columns]
     tab = html.Div([
         dbc.Row([
             dbc.Col(html.Div([
@@ -382,6 +459,10 @@ def get_tab_sensitivity_analysis():
             ]), width=6, align="start"),
         ], justify="evenly", className="row-gsa", style={"marginBottom": "60px"}),
         dbc.Col(html.H2("Influential model inputs, aka GSA results")),
+        html.Div([
+            html.Label("Previous runs", className="label"),
+            dcc.Dropdown(id="previous-run", placeholder="Load results of a finished run"),
+        ], className="control-previous-run"),
         dbc.Row([
             dcc.Markdown(
                     '''
@@ -396,7 +477,9 @@ def get_tab_sensitivity_analysis():
                 ),
             dbc.Col(
                 dash_table.DataTable(
-                    data=df_data, columns=columns, id="ranking-table", page_size=PAGE_SIZE, sort_action='native',
+                    data=df_data, columns=columns, id="ranking-table", page_size=PAGE_SIZE, page_current=0,
+                    page_action='custom', sort_action='custom', sort_mode='multi', filter_action='custom',
+                    filter_query='',
                     style_table={"font-family": "sans-serif", "borderBottom": f'1px solid {color_light_purple}',
                                  'textOverflow': 'ellipsis'},
                     style_header={'backgroundColor': f'{color_light_purple}', 'textAlign': 'center',
@@ -418,7 +501,9 @@ def get_tab_sensitivity_analysis():
                 ),
             ),
         ], justify="evenly", className="row-gsa"),
-        dcc.Store(id='sensitivity-indices'),
+        # Run whose GSA results are validated, the results stay on the server
+        dcc.Store(id='gsa-directory'),
+        dcc.Store(id='ranking-directory'),
     ], className="tab-sensitivity", style={"width": "1460px"})
     return tab
 
@@ -433,16 +518,21 @@ def get_style_data_conditional(bg_color):
     return style_data_conditional
 
 
-def style_bars_in_datatable(df, column, color_bars=color_blue, bar_percentage_in_cell=70):
-    styles = get_style_data_conditional(color_even)
+def style_bars_in_datatable(df, column, color_bars=color_blue, bar_percentage_in_cell=70, max_value=None):
+    """Bars for the rows of `df`, which is the page currently shown in the table.
+
+    `max_value` should be the maximum over the whole table, so that bars are comparable across pages.
+    """
+    styles = []
     values = df[column].values
-    max_value = values.max()
+    if max_value is None:
+        max_value = values.max()
     for i, val in enumerate(values):
         color_row = color_even if i % 2 == 0 else color_odd
-        max_bound_percentage = int(val/max_value * bar_percentage_in_cell)
+        max_bound_percentage = int(val/max_value * bar_percentage_in_cell) if max_value else 0
         style_element = {
             'if': {
-                'filter_query': '{{column}} = {{val}} && {{Rank}}={i}'.format(column=column, val=val, i=i+1),
+                'row_index': i,
                 'column_id': column,
             },
             'background': (
@@ -521,7 +611,10 @@ def get_tab_gsa_validation():
                         '''
                         To determine how many inputs capture the overall LCIA scores distribution sufficiently, we run 
                         additional MC simulations for the increasing number of ranked influential inputs. Specify below 
-                        the minimum, maximum and step for the number of influential inputs to test.
+                        the minimum, maximum and step for the number of influential inputs to test. With the adaptive
+                        search, only the sizes needed to find the smallest set that reaches the target correlation are
+                        simulated. The preview fits a surrogate model on the existing MC simulations and estimates
+                        the whole curve within seconds, the exact LCA runs then serve as confirmation.
                         ''',
                         style={"marginBottom": "16px", "textAlign": "center"}
                     ),
@@ -538,7 +631,7 @@ def get_validation_controls():
     slider_inputs = html.Div([
         html.Div([
             html.Label("Inputs min", className="label"),
-            dbc.Input(id="val-min", value=VALIDATION_MIN, type="number")
+            dbc.Input(id="val-min", value=VALIDATION_MIN, type="number", min=0)
         ], className="val-min"),
         html.Div([
             html.Label("Inputs max", className="label"),
@@ -561,16 +654,37 @@ def get_validation_controls():
             html.Label("Iterations", className="label"),
             dbc.Input(id="val-iterations", value=VALIDATION_ITERATIONS, type="number")
         ], className="val-iterations"),
+        html.Div([
+            html.Label("Search", className="label"),
+            dcc.Dropdown(["grid", "adaptive"], value=VALIDATION_MODE, id="val-mode", clearable=False)
+        ], className="val-mode"),
+        html.Div([
+            html.Label("Target", className="label"),
+            dbc.Input(id="val-target", value=VALIDATION_TARGET, type="number", min=0, max=1, step=0.01)
+        ], className="val-target"),
+        html.Div([
+            html.Label("Time budget, min", className="label"),
+            dbc.Input(id="val-time-budget", value=VALIDATION_TIME_BUDGET, type="number", min=0)
+        ], className="val-time-budget"),
         dbc.Button("Start", id="btn-start-val", n_clicks=0, outline=False, color="primary",
                    className="btn-start-val"),
         dbc.Button("Cancel", id="btn-cancel-val", n_clicks=0, outline=False, color="warning",
-                   className="btn-cancel-val"),
+                   className="btn-cancel-val", disabled=True),
+        dbc.Button("Preview", id="btn-preview-val", n_clicks=0, outline=True, color="primary",
+                   className="btn-preview-val"),
+        dcc.Store(id="val-preview"),
         dcc.Store(id="val-directory"),
         dcc.Store(id="val-state", data=0),
         dcc.Store(id="val-finished", data=False),
-        dcc.Interval(id="val-interval", n_intervals=0, interval=INTERVAL_TIME * 1000),
+        dcc.Store(id="val-cancelled", data=False),
+        EventSource(id="val-events"),
     ], className="val-controls-container")
-    val_controls = [slider_inputs, iterations_inputs]
+    progress = html.Div([
+        html.Label("Progress:"),
+        dbc.Progress(id="val-progress", className="mc-progress", value=0, label="0%"),
+        html.Div(id="val-influential", className="mc-stopping"),
+    ], className="mc-progress-container")
+    val_controls = [slider_inputs, iterations_inputs, progress]
     return val_controls
 
 
@@ -602,6 +716,10 @@ def get_mc_config(state_or_input):
         iterations=state_or_input('iterations', 'value'),
         iterations_chunk=state_or_input('iterations-chunk', 'value'),
         seed=state_or_input("seed", "value"),
+        sampling=state_or_input("sampling", "value"),
+        stopping=state_or_input("stopping", "value"),
+        time_budget=state_or_input("time-budget", "value"),
+        uncertainty=state_or_input("uncertainty", "value"),
     )
     return mc_config
 
@@ -619,5 +737,8 @@ def get_val_config(state_or_input):
         val_max=state_or_input('val-max', 'value'),
         val_step=state_or_input("val-step", "value"),
         val_iterations=state_or_input("val-iterations", "value"),
+        val_mode=state_or_input("val-mode", "value"),
+        val_target=state_or_input("val-target", "value"),
+        val_time_budget=state_or_input("val-time-budget", "value"),
     )
     return val_config
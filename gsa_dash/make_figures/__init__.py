@@ -1,4 +1,5 @@
 from .uncertainty_distributions import plot_mc_simulations
-from .sensitivity_results import plot_model_linearity, create_table_gsa_ranking
+from .sensitivity_results import plot_model_linearity, create_table_gsa_ranking, create_empty_table_gsa_ranking, query_table_gsa_ranking
 from .validation import plot_validation
 from .utils import get_figure_layout
+from .diagnostics import plot_stage_timings
@@ -0,0 +1,28 @@
+from .utils import get_figure_layout
+
+
+def plot_stage_timings(timings=None, val_timings=None):
+    """Horizontal bars with total time per stage of the MC and GSA run, and of its validation."""
+    data = []
+    for name, stage_timings, color in [("MC and GSA", timings, "#5757E5"), ("Validation", val_timings, "#9EC7E4")]:
+        if not stage_timings:
+            continue
+        stages = sorted(stage_timings, key=lambda stage: stage_timings[stage]["seconds"])
+        data.append(dict(
+            type="bar", orientation="h",
+            x=[stage_timings[stage]["seconds"] for stage in stages],
+            y=[f"{stage} ({name.lower()})" for stage in stages],
+            text=[f"{stage_timings[stage]['count']} calls" for stage in stages],
+            marker=dict(color=color), name=name, showlegend=True,
+        ))
+    layout = get_figure_layout()
+    layout["xaxis"]["title"].update(dict(text="Total time, seconds"))
+    layout["yaxis"]["automargin"] = True
+    layout["height"] = 400
+    layout["legend"].update(dict(
+        x=0.5, xanchor="center",
+        y=-0.2, yanchor="top",
+        orientation="h"),
+    )
+    layout["margin"].update(dict(l=60, b=50, r=10, t=0))
+    return dict(data=data, layout=layout)
@@ -1,5 +1,5 @@
-import pandas as pd
 import numpy as np
+import re
 
 # Local files
 from .utils import get_figure_layout
@@ -46,17 +46,18 @@ def plot_model_linearity(linearity=None, linearity_threshold=0.8, iterations_def
     return dict(data=data, layout=layout)
 
 
+def create_empty_table_gsa_ranking(n_entries=20):
+    """Rows and columns of the empty ranking table, without pandas, so that the layout is built quickly."""
+    columns = ["Rank", "LCA model input", "Amount", "Type", "GSA index", "Contribution"]
+    records = [{column: (i + 1 if column == "Rank" else None) for column in columns} for i in range(n_entries)]
+    return records, columns
+
+
 def create_table_gsa_ranking(data=None, n_entries=20):
+    import pandas as pd
     if data is None:
-        df_data = {
-            "Rank": list(range(1, n_entries+1)),
-            "LCA model input": [None]*n_entries,
-            "Amount": [None]*n_entries,
-            "Type": [None]*n_entries,
-            "GSA index": [None]*n_entries,
-            "Contribution": [None]*n_entries,
-        }
-        df = pd.DataFrame.from_dict(df_data)
+        records, columns = create_empty_table_gsa_ranking(n_entries)
+        df = pd.DataFrame.from_records(records, columns=columns)
     else:
         n_entries = len(data["GSA index"])
         inputs = []
@@ -83,3 +84,57 @@ def create_table_gsa_ranking(data=None, n_entries=20):
         columns = ["Rank"] + columns
         df = df[columns]
     return df
+
+
+FILTER_OPERATORS = [
+    ["ge", ">="], ["le", "<="], ["lt", "<"], ["gt", ">"], ["ne", "!="], ["eq", "="], ["contains"],
+]
+# Operator directly after the column name, symbols first by length, words only as whole words
+FILTER_PART = re.compile(
+    r"^\s*\{(?P<name>[^}]*)\}\s*(?P<operator>>=|<=|!=|<|>|=|(?:ge|le|lt|gt|ne|eq|contains)(?=\s|$))\s*(?P<value>.*)$",
+    re.DOTALL,
+)
+
+
+def split_filter_part(filter_part):
+    """Split one part of DataTable filter query, e.g. `{GSA index} > 0.1`, into column name, operator and value."""
+    match = FILTER_PART.match(filter_part)
+    if match is None:
+        return [None] * 3
+    name, operator, value_part = match.group("name"), match.group("operator"), match.group("value").strip()
+    operator = next(operator_type[0] for operator_type in FILTER_OPERATORS if operator in operator_type)
+    v0 = value_part[0] if value_part else ""
+    # Empty values, e.g. while typing `{Activity} contains `, are not indexed
+    if value_part and v0 == value_part[-1] and v0 in ("'", '"', "`"):
+        value = value_part[1:-1].replace("\\" + v0, v0)
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return name, operator, value
+
+
+def query_table_gsa_ranking(df, page_current=0, page_size=20, sort_by=None, filter_query=""):
+    """Filter, sort and paginate GSA ranking table on the server, returns the current page and number of pages."""
+    for filter_part in (filter_query or "").split(" && "):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            try:
+                df = df.loc[getattr(df[col_name], operator)(filter_value)]
+            except TypeError:
+                # Values that cannot be compared with the column, e.g. `> 1` on text, match no rows
+                df = df.iloc[:0]
+        elif operator == "contains":
+            df = df.loc[df[col_name].astype(str).str.contains(str(filter_value), case=False, regex=False)]
+    if sort_by:
+        df = df.sort_values(
+            [col["column_id"] for col in sort_by],
+            ascending=[col["direction"] == "asc" for col in sort_by],
+            inplace=False,
+        )
+    page_count = max(int(np.ceil(len(df) / page_size)), 1)
+    df_page = df.iloc[page_current*page_size: (page_current+1)*page_size]
+    return df_page, page_count
@@ -7,7 +7,7 @@ color_deterministic_score = color_bs_red
 opacity = 0.7
 
 
-def plot_mc_simulations(deterministic_score=None, unit=None, mc_scores=None, iterations=None):
+def plot_mc_simulations(deterministic_score=None, unit=None, mc_scores=None, iterations=None, mc_histogram=None):
     data = []
     unit_str = ""
     data.append(dict(
@@ -44,7 +44,9 @@ def plot_mc_simulations(deterministic_score=None, unit=None, mc_scores=None, ite
         )]
         num_bins = 60
         bins_ = np.linspace(min(mc_scores), max(mc_scores), num_bins, endpoint=True)
-        freq, bins = np.histogram(mc_scores, bins=bins_)
+        mc_histogram = np.histogram(mc_scores, bins=bins_)
+    if mc_histogram is not None:
+        freq, bins = mc_histogram
         ymax = max(ymax, max(freq)) + 2
         data[1]["x"] = bins
         data[1]["y"] = freq
@@ -1,7 +1,7 @@
 from .utils import get_figure_layout
 
 
-def plot_validation(min_influential, max_influential, metric=None):
+def plot_validation(min_influential, max_influential, metric=None, metric_preview=None, error_preview=None):
     data = [dict(
         type="scatter", x=[None], y=[None],
         mode="markers+lines", marker=dict(symbol="x", size=10, color="blue"),
@@ -24,5 +24,14 @@ def plot_validation(min_influential, max_influential, metric=None):
         y = list(metric.values())
         data[0]["x"] = x
         data[0]["y"] = y
+    if metric_preview is not None:
+        x = [int(k) for k in metric_preview.keys()]
+        data.append(dict(
+            type="scatter", x=x, y=list(metric_preview.values()),
+            mode="markers+lines", marker=dict(symbol="circle-open", size=8, color="gray"),
+            line=dict(dash="dot"),
+            error_y=dict(type="data", array=list(error_preview.values()) if error_preview is not None else None),
+            name="Surrogate model preview", showlegend=True,
+        ))
 
     return dict(data=data, layout=layout)
@@ -0,0 +1,77 @@
+from pathlib import Path
+
+# Local files
+from backend.data import collect_XY, collect_run_Y, read_pickle, write_ranking, read_ranking
+from backend.life_cycle_assessment import get_bw_activity_and_method
+from backend.metrics import span, track_run
+from backend.projects import project_context
+from backend.sensitivity_analysis import (
+    compute_model_linearity, compute_sensitivity_indices, collect_sensitivity_results, contribution_analysis,
+    compute_model_linearity_blockwise, compute_sensitivity_indices_blockwise,
+)
+from backend.results import write_results, read_results
+from backend.x_store import has_X_store
+from make_figures import create_table_gsa_ranking
+from constants import LINEARITY_THRESHOLD, GT_CUTOFF, GT_MAXCALC, PAGE_SIZE
+
+
+def run_sensitivity_analysis(directory, lca_config):
+    """GSA of a finished MC run, the ranking table is stored in the run directory for the dashboard.
+
+    Results are persisted in the run directory too, and reused as long as the MC chunks of the run do not change. GSA
+    runs in a context of the project, since it is called from threaded callbacks.
+    """
+    directory = Path(directory)
+    results = read_results(directory)
+    if results is not None:
+        return results["model_linearity"], results["sensitivity_indices"], read_ranking(directory)
+    project, database, activity, amount, method = lca_config["project"], lca_config["database"], \
+                                                  lca_config["activity"], lca_config["amount"], lca_config["method"]
+    with project_context(project), track_run(directory):
+        if has_X_store(directory):
+            # X with background uncertainty may not fit in memory, GSA reads it block by block
+            with span("collect_XY"):
+                Y = collect_run_Y(directory)
+                indices = read_pickle(directory / "indices.pickle")
+            with span("model_linearity"):
+                model_linearity = compute_model_linearity_blockwise(directory, Y)
+            sensitivity_indices, sensitivity_method = compute_sensitivity_indices_blockwise(
+                directory, Y, model_linearity, LINEARITY_THRESHOLD
+            )
+        else:
+            with span("collect_XY"):
+                X, Y = collect_XY(directory)
+                indices = read_pickle(directory / "indices.pickle")
+            with span("model_linearity"):
+                model_linearity = compute_model_linearity(X, Y)
+            sensitivity_indices, sensitivity_method = compute_sensitivity_indices(
+                X, Y, model_linearity, LINEARITY_THRESHOLD
+            )
+        contributions = contribution_analysis(
+            directory, project, database, activity, amount, method, GT_CUTOFF, GT_MAXCALC
+        )
+        with span("collect_sensitivity_results"):
+            sensitivity_data = collect_sensitivity_results(
+                project, sensitivity_indices, contributions, indices, sensitivity_method,
+            )
+            df = create_table_gsa_ranking(sensitivity_data, PAGE_SIZE)
+            write_ranking(df, directory)
+            metadata = get_results_metadata(directory, lca_config, len(Y))
+            write_results(directory, model_linearity, sensitivity_indices, sensitivity_method, contributions, metadata)
+    return model_linearity, sensitivity_indices, df
+
+
+def get_results_metadata(directory, lca_config, iterations):
+    """LCA config of a run with the names it resolves to, for the list of previous runs."""
+    import bw2data as bd
+    bw_activity, bw_method = get_bw_activity_and_method(
+        lca_config["project"], lca_config["database"], lca_config["activity"], lca_config["method"]
+    )
+    return dict(
+        **lca_config,
+        activity_name=bw_activity["name"],
+        activity_location=bw_activity.get("location"),
+        unit=bd.Method(bw_method).metadata.get("unit", ""),
+        run=Path(directory).name,
+        iterations=iterations,
+    )